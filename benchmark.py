@@ -0,0 +1,104 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+from src.map.game_map import GameMap, LEVEL_CONFIGURATIONS
+from src.rng import seed_game
+from src.timing import PhaseTimer
+
+
+def generate_map(dungeon_level, seed, timer):
+    # Returns the level and the time taken to generate it, or raises whatever generation raised
+    seed_game(seed)
+    start_time = time.perf_counter()
+    game_map = GameMap(dungeon_level, timer)
+    return game_map, time.perf_counter() - start_time
+
+
+def measure_peak_memory(dungeon_level, seed):
+    # Generates the same level again with allocations traced, since tracing would distort the timings
+    tracemalloc.start()
+    try:
+        seed_game(seed)
+        GameMap(dungeon_level).close()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_level(dungeon_level, runs, base_seed, trace_memory=True):
+    # Yields a record of each run's timings, in seconds, and peak memory, in bytes
+    timer = PhaseTimer()
+
+    for run in range(runs):
+        seed = '{0}:{1}'.format(base_seed, run)
+        record = {'level': dungeon_level, 'run': run, 'seed': seed}
+
+        timer.clear()
+        try:
+            game_map, record['total'] = generate_map(dungeon_level, seed, timer)
+            record['phases'] = timer.totals()
+            record['unjoined_areas'] = len(game_map.generator.unjoinedAreas)
+            game_map.close()
+            if trace_memory:
+                record['peak_memory'] = measure_peak_memory(dungeon_level, seed)
+        except Exception as error:
+            # Generation can fail for some seeds; the failure is recorded rather than ending the benchmark
+            record['error'] = repr(error)
+
+        yield record
+
+
+def print_summary(records):
+    # Prints the mean total time and the slowest phases for each level
+    levels = {}
+    for record in records:
+        levels.setdefault(record['level'], []).append(record)
+
+    for dungeon_level, level_records in sorted(levels.items()):
+        completed = [record for record in level_records if 'error' not in record]
+        summary = 'Level {0}: {1}/{2} maps'.format(dungeon_level, len(completed), len(level_records))
+
+        if completed:
+            mean_total = sum(record['total'] for record in completed) / len(completed)
+            summary += ', {0:.1f} ms'.format(mean_total * 1000)
+
+            if completed[0].get('peak_memory') is not None:
+                peak_memory = max(record['peak_memory'] for record in completed)
+                summary += ', {0:.0f} KiB peak'.format(peak_memory / 1024)
+
+            phase_totals = {}
+            for record in completed:
+                for phase, seconds in record['phases'].items():
+                    phase_totals[phase] = phase_totals.get(phase, 0) + seconds
+            slowest = sorted(phase_totals.items(), key=lambda phase: phase[1], reverse=True)[:3]
+            summary += ' ({0})'.format(', '.join('{0} {1:.1f} ms'.format(phase, seconds * 1000 / len(completed))
+                                                 for phase, seconds in slowest))
+
+        print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the generation of every level of GeneriCrawl')
+    parser.add_argument('--runs', type=int, default=5, help='number of maps to generate for each level')
+    parser.add_argument('--levels', type=int, nargs='+', help='levels to generate (default: all of them)')
+    parser.add_argument('--seed', default='benchmark', help='base seed; each run of each level has its own')
+    parser.add_argument('--output', default='benchmark.jsonl', help='file to write one JSON record per map to')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    args = parser.parse_args()
+
+    levels = args.levels or sorted(LEVEL_CONFIGURATIONS.keys())
+
+    records = []
+    with open(args.output, 'w') as output_file:
+        for dungeon_level in levels:
+            for record in benchmark_level(dungeon_level, args.runs, args.seed, not args.no_memory):
+                output_file.write(json.dumps(record) + '\n')
+                records.append(record)
+
+    print_summary(records)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,16 @@
+import argparse
 import json
 
 from src.color_schemes import ColorSchemes, init_color_schemes
-from src.components.container import Container
-from src.components.fighter import Fighter
-from src.components.sight import Sight
-from src.components.slots import Slots
-from src.entity import Entity
 from src.fov import *
 from src.game_messages import MessageLog, Message, join_list
 from src.game_states import GameStates
 from src.input import InputSchemes, handle_mouse
-from src.map.game_map import GameMap, LEVEL_CONFIGURATIONS, STAIRS
 from src.menu import construct_inventory_options
-from src.render import render_all, clear_all, RenderOrder
+from src.render import render_all, RenderCache
+from src.rng import seed_game
+from src.timing import NULL_TIMER, PhaseTimer, TIMING_WINDOW
+from src.turn_engine import EventTypes, TurnEngine
 
 
 def get_mouse_tile(console_width, console_height, player_x, player_y, mouse_x, mouse_y):
@@ -66,9 +64,22 @@ def get_look_message(x, y, game_map, fov_map, player):
 
 
 def main():
+    parser = argparse.ArgumentParser(description='GeneriCrawl')
+    parser.add_argument('--seed', help='seed for a reproducible game, overriding the seed in options.json')
+    parser.add_argument('--timing-file', help='file to append per-phase turn timings to on exit, overriding the '
+                                              'timing file in options.json')
+    args = parser.parse_args()
+
     with open('options.json') as option_file:
         options = json.load(option_file)
 
+    # The same seed always gives the same levels and the same fights
+    seed = args.seed if args.seed is not None else options.get('seed')
+
+    # Phases of each turn are only timed when there is a file to write the timings to
+    timing_file = args.timing_file if args.timing_file is not None else options.get('timing_file')
+    timer = PhaseTimer(TIMING_WINDOW) if timing_file else NULL_TIMER
+
     init_color_schemes()
 
     # Screen dimensions, in characters
@@ -91,49 +102,37 @@ def main():
     libtcod.console_init_root(screen_width, screen_height, 'GeneriCrawl', False)
     console = libtcod.console_new(screen_width, screen_height)
     panel = libtcod.console_new(panel_width, panel_height)
-    message_log = MessageLog(message_x, message_width, message_height)
+    message_log = MessageLog(message_x, message_width, message_height, spill_file=options.get('message_log_file'))
 
     restart = True
     while restart:
-        restart = play_game(console, panel, bar_width, message_log, options)
+        restart = play_game(console, panel, bar_width, message_log, options, seed=seed, timer=timer)
+
+    message_log.close()
 
     with open('options.json', 'w') as option_file:
         json.dump(options, option_file)
 
+    if timing_file:
+        timer.dump(timing_file)
+
+
+def play_game(console, panel, bar_width, message_log, options, viewing_map=False, seed=None, timer=NULL_TIMER):
+    seed_game(seed)
 
-def play_game(console, panel, bar_width, message_log, options, viewing_map=False):
     color_scheme = get_scheme(options.get('color_scheme'), ColorSchemes)
     input_scheme = get_scheme(options.get('input_scheme'), InputSchemes)
 
-    game_map = GameMap(1)
-    start_tile = LEVEL_CONFIGURATIONS.get(1).get('start_tile')
-    if viewing_map:
-        player_tile = (int(game_map.width / 2), int(game_map.height / 2))
-    else:
-        player_tile = game_map.find_open_tile(tile_type=start_tile)
-    player_char = '@' if not viewing_map else ' '
-    player_sight = Sight()
-    player_fighter = Fighter(hp=20, defense=1, attack=1, damage=2)
-    player_slots = Slots()
-    player_container = Container(20)
-    player = Entity(*player_tile, player_char, libtcod.white, 'player', render_order=RenderOrder.PLAYER,
-                    components={'sight': player_sight, 'fighter': player_fighter, 'slots': player_slots,
-                                'container': player_container})
-
-    game_map.entities.append(player)
-
-    recompute_fov = True
-    fov_map = game_map.generate_fov_map()
-    memory = [[False for y in range(game_map.height)] for x in range(game_map.width)]
+    turn_engine = TurnEngine(viewing_map, timer)
+    player = turn_engine.player
+    render_cache = RenderCache(console)
 
     key = libtcod.Key()
     mouse = libtcod.Mouse()
 
-    game_state = GameStates.PLAYER_TURN
+    game_state = turn_engine.game_state
     previous_game_state = game_state
 
-    previous_max_hp = player.fighter.max_hp
-
     key_cursor = (0, 0)
     menu_selection = 0
     inventory_options = None
@@ -143,17 +142,20 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
     exit_queued = False
 
     while not libtcod.console_is_window_closed():
-        if recompute_fov:
-            player.sight.get_fov(fov_map, memory)
+        turn_engine.update_fov()
+
+        with timer.phase('render'):
+            render_all(console, panel, bar_width, message_log, turn_engine.game_map, player, turn_engine.fov_map,
+                       turn_engine.memory, color_scheme.value, game_state, mouse, menu_selection,
+                       key_cursor if game_state is GameStates.TARGETING else None, inventory_options, viewing_map,
+                       render_cache)
+            libtcod.console_flush()
 
-        render_all(console, panel, bar_width, message_log, game_map, player, fov_map, memory, color_scheme.value,
-                   game_state, mouse, menu_selection, key_cursor if game_state is GameStates.TARGETING else None,
-                   inventory_options, viewing_map)
-        libtcod.console_flush()
-        libtcod.sys_wait_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse, True)
-        clear_all(console, game_map.entities, player)
+        with timer.phase('input'):
+            libtcod.sys_wait_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse, True)
 
-        recompute_fov = False
+        game_map = turn_engine.game_map
+        fov_map = turn_engine.fov_map
 
         mouse_action = handle_mouse(mouse)
         action = input_scheme.value.handle_key(key, game_state)
@@ -178,8 +180,8 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
         color_scheme_input = action.get('color_scheme')
         input_scheme_input = action.get('input_scheme')
 
-        player_results = {}
-        player_acted = False
+        # The action to be resolved by the turn engine, if any
+        turn_action = None
 
         do_use = False
         combine_target = None
@@ -210,47 +212,7 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
                 # moved = False
 
                 if move:
-                    if player.move(dx, dy, game_map, face=False):
-                        player_acted = True
-                        recompute_fov = True
-
-                        entities_at_tile = game_map.get_entities_at_tile(player.x, player.y)
-                        entities_at_tile.remove(player)
-                        if entities_at_tile:
-                            message_log.add_message(Message('You see {0}.'.format(join_list([
-                                entity.indefinite_name for entity in entities_at_tile])), libtcod.light_gray))
-                        # moved = True
-                    else:
-                        blocking_entities = game_map.get_entities_at_tile(player.x + dx, player.y + dy, True)
-                        if blocking_entities:
-                            target = blocking_entities[0]
-                            attack_results = player.fighter.attack_entity(target.fighter, is_player=True)
-                            player_results.update(attack_results)
-                            player_acted = True
-                            # moved = True
-                        elif game_map.get_tile(player.x + dx, player.y + dy, raw=True) is STAIRS:
-                            dungeon_level = game_map.dungeon_level + 1
-                            configuration = LEVEL_CONFIGURATIONS.get(dungeon_level)
-                            if not configuration:
-                                game_state = GameStates.VICTORY
-                            else:
-                                game_map = GameMap(game_map.dungeon_level + 1)
-
-                                # player.fighter.base_max_hp += 10
-                                player.fighter.hp = player.fighter.max_hp
-                                start_tile = configuration.get('start_tile')
-                                if start_tile:
-                                    player.x, player.y = game_map.find_open_tile(tile_type=start_tile)
-                                else:
-                                    player.x, player.y = game_map.find_open_tile()
-                                game_map.entities.append(player)
-
-                                recompute_fov = True
-                                fov_map = game_map.generate_fov_map()
-                                memory = [[False for y in range(game_map.height)] for x in range(game_map.width)]
-                                player_acted = False
-
-                                libtcod.console_clear(console)
+                    turn_action = {'move': direction}
 
                 # In the event that the player moves into a wall, do not adjust facing
                 # if face and (not move or moved):
@@ -295,26 +257,11 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
                 do_target = True
 
         if pickup and game_state is GameStates.PLAYER_TURN:
-            entities_at_tile = game_map.get_entities_at_tile(player.x, player.y)
-            for entity in entities_at_tile:
-                if entity.item:
-                    player_results.update(player.container.add_item(entity))
-                    player_acted = True
-                    break
-            else:
-                message_log.add_message(Message('There is nothing here to pick up.', libtcod.yellow))
+            turn_action = {'pickup': True}
 
         if drop and game_state is GameStates.INVENTORY:
             if menu_selection < len(inventory_options):
-                item = player.container.get_item(inventory_options[menu_selection])
-                player.container.items.remove(item)
-                if player.slots.is_equipped(item):
-                    player.slots.toggle_equip(item)
-                item.x = player.x
-                item.y = player.y
-                game_map.entities.append(item)
-                message_log.add_message(Message('You drop {0}.'.format(item.definite_name), libtcod.light_blue))
-                player_acted = True
+                turn_action = {'drop': player.container.get_item(inventory_options[menu_selection])}
 
         if use and game_state is GameStates.INVENTORY:
             do_use = True
@@ -345,14 +292,10 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
             message_log.add_message(Message('Select a tile to look at. Escape to cancel.', libtcod.light_gray))
 
         if wait and game_state is GameStates.PLAYER_TURN:
-            if viewing_map:
-                game_map = GameMap(game_map.dungeon_level + 1)
-                player.x = int(game_map.width / 2)
-                player.y = int(game_map.height / 2)
-            else:
-                player_acted = True
+            turn_action = {'wait': True}
 
         if restart and game_state is GameStates.PLAYER_DEAD:
+            turn_engine.close()
             return True
 
         if exit:
@@ -364,6 +307,7 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
                 throwing = None
                 looking = False
             elif exit_queued:
+                turn_engine.close()
                 return False
             else:
                 exit_queued = True
@@ -385,31 +329,10 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
         # Process actions with multiple triggers
         if do_use:
             if menu_selection < len(inventory_options):
-                use_results = player.container.get_item(inventory_options[menu_selection]).item.use(player, game_map)
-                player_results.update(use_results)
-                player_acted = True
+                turn_action = {'use': player.container.get_item(inventory_options[menu_selection])}
 
         if combine_target:
-            if combining is combine_target:
-                message_log.add_message(Message('An item cannot be combined with itself.', libtcod.yellow))
-            else:
-                result = None
-                if combining.item.combine_function:
-                    result = combining.item.use(player, game_map, combining=True, combine_target=combine_target)
-
-                if result:
-                    player_results.update(result)
-                    player_acted = True
-                else:
-                    if combining.item.combine_function:
-                        result = combining.item.use(player, game_map, combining=True, combine_target=combining)
-
-                    if result:
-                        player_results.update(result)
-                        player_acted = True
-                    else:
-                        message_log.add_message(Message('These items cannot be combined.', libtcod.yellow))
-
+            turn_action = {'combine': (combining, combine_target)}
             combining = None
             game_state = previous_game_state
 
@@ -420,124 +343,30 @@ def play_game(console, panel, bar_width, message_log, options, viewing_map=False
                     message_log.add_message(look_message)
                 game_state = previous_game_state
                 looking = False
-            elif throwing and (player.x, player.y) != key_cursor and libtcod.map_is_in_fov(fov_map, *key_cursor) and \
-                    game_map.is_tile_open(*key_cursor, check_entities=False):
-                if player.slots.is_equipped(throwing):
-                    player.slots.toggle_equip(throwing)
-                throw_results = throwing.item.use(player, game_map, throwing=True, target_x=key_cursor[0],
-                                                  target_y=key_cursor[1])
-                player_results.update(throw_results)
-                game_state = previous_game_state
-                throwing = None
-                player_acted = True
-
-        if player_acted:
-            player_results.update(player.update_status_effects())
-            if player.fighter.max_hp < previous_max_hp:
-                player.fighter.hp = max(1, player.fighter.hp - (previous_max_hp - player.fighter.max_hp))
-            previous_max_hp = player.fighter.max_hp
-            exit_queued = False
-
-        # Process player turn results
-        attack_message = player_results.get('attack_message')
-        pickup_message = player_results.get('pickup_message')
-        use_message = player_results.get('use_message')
-        effect_message = player_results.get('effect_message')
-        new_messages = [attack_message, pickup_message, use_message, effect_message]
-
-        recompute_fov = recompute_fov or player_results.get('recompute_fov')
-        update_fov_map = player_results.get('update_fov_map')
-        dead_entities = player_results.get('dead')
-        next_level = player_results.get('next_level')
-        item_obtained = player_results.get('item_obtained')
-        item_moved = player_results.get('item_moved')
-        item_consumed = player_results.get('item_consumed') or item_moved
-
-        for message in new_messages:
-            if message:
-                message_log.add_message(message)
-
-        if update_fov_map:
-            fov_map = game_map.generate_fov_map()
-
-        if dead_entities:
-            for dead_entity in dead_entities:
-                if dead_entity == player:
-                    message = player.kill(is_player=True)
-                    previous_game_state = GameStates.PLAYER_DEAD
-                    game_state = GameStates.PLAYER_DEAD
-                else:
-                    message = dead_entity.kill()
-                message_log.add_message(message)
-
-        if next_level:
-            # Partially copied from code under "direction"
-            game_map = GameMap(game_map.dungeon_level + 1)
+            elif throwing:
+                turn_action = {'throw': (throwing, key_cursor)}
 
-            player.x, player.y = game_map.find_open_tile()
-            game_map.entities.append(player)
+        if turn_action:
+            with timer.phase('turn'):
+                events = turn_engine.act(turn_action)
 
-            recompute_fov = True
-            fov_map = game_map.generate_fov_map()
-            memory = [[False for y in range(game_map.height)] for x in range(game_map.width)]
-
-            libtcod.console_clear(console)
-
-        if item_obtained and item_obtained in game_map.entities:
-            game_map.entities.remove(item_obtained)
-
-        if item_consumed or item_moved:
-            if type(item_consumed) is list:
-                for item in item_consumed:
-                    player.container.items.remove(item)
-
-                    if player.slots.is_equipped(item):
-                        player.slots.toggle_equip(item)
-            else:
-                player.container.items.remove(item_consumed)
-
-                if player.slots.is_equipped(item_consumed):
-                    player.slots.toggle_equip(item_consumed)
-
-            if item_moved:
-                item_moved.x = player_results.get('item_x')
-                item_moved.y = player_results.get('item_y')
-
-                if item_moved not in game_map.entities:
-                    game_map.entities.append(item_moved)
-
-        if player_acted:
-            game_state = GameStates.ENEMY_TURN
-
-        if game_state is GameStates.ENEMY_TURN:
-            enemy_fov_map = game_map.generate_fov_map_with_entities()
-            for entity in game_map.entities:
-                if entity.ai:
-                    enemy_results = entity.ai.act(game_map, player, enemy_fov_map,
-                                                  libtcod.map_is_in_fov(fov_map, entity.x, entity.y))
-
-                    # Process enemy turn results
-                    attack_message = enemy_results.get('attack_message')
-                    dead_entities = enemy_results.get('dead')
-
-                    if attack_message:
-                        message_log.add_message(attack_message)
-
-                    if dead_entities:
-                        for dead_entity in dead_entities:
-                            if dead_entity == player:
-                                message = player.kill(is_player=True)
-                                message_log.add_message(message)
-                                game_state = GameStates.PLAYER_DEAD
-                                break
-                            else:
-                                message = dead_entity.kill()
-                                message_log.add_message(message)
-
-                if game_state is GameStates.PLAYER_DEAD:
-                    break
-            else:
-                game_state = GameStates.PLAYER_TURN
+            for event_type, value in events:
+                if event_type is EventTypes.MESSAGE:
+                    message_log.add_message(value)
+                elif event_type is EventTypes.DEATH and value is player:
+                    previous_game_state = GameStates.PLAYER_DEAD
+                elif event_type is EventTypes.LEVEL_CHANGE:
+                    libtcod.console_clear(console)
+                    render_cache.invalidate()
+                elif event_type is EventTypes.TURN:
+                    # Taking a turn closes any menu or targeting
+                    game_state = turn_engine.game_state
+                    throwing = None
+                    exit_queued = False
+                elif event_type is EventTypes.GAME_STATE:
+                    game_state = value
+
+    turn_engine.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+import argparse
+import random
+import time
+
+from src.game_states import GameStates
+from src.map.game_map import STAIRS
+from src.rng import seed_game
+from src.timing import NULL_TIMER, PhaseTimer, TIMING_WINDOW
+from src.turn_engine import EventTypes, TurnEngine
+
+DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+# The most actions in a row the player may take without using up a turn before the simulation gives up
+MAX_IDLE_ACTIONS = 1000
+
+
+class BotPolicy:
+    """
+    Plays like a careless player: attacks adjacent enemies, picks up whatever it stands on, takes any stairs it finds
+    and otherwise wanders in straight lines, turning at random when it is blocked. The bot uses its own random stream,
+    so it does not disturb the game's.
+    """
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.direction = DIRECTIONS[0]
+
+    def next_action(self, turn_engine):
+        game_map = turn_engine.game_map
+        player = turn_engine.player
+
+        for dx, dy in DIRECTIONS:
+            if game_map.get_entities_at_tile(player.x + dx, player.y + dy, True):
+                return {'move': (dx, dy)}
+
+        for entity in game_map.get_entities_at_tile(player.x, player.y):
+            if entity.item and len(player.container.items) < player.container.capacity:
+                return {'pickup': True}
+
+        for dx, dy in DIRECTIONS:
+            if game_map.get_tile(player.x + dx, player.y + dy, raw=True) is STAIRS:
+                return {'move': (dx, dy)}
+
+        if self.random.random() < 0.05:
+            return {'wait': True}
+
+        if not game_map.is_tile_open(player.x + self.direction[0], player.y + self.direction[1]):
+            self.direction = self.random.choice(DIRECTIONS)
+
+        return {'move': self.direction}
+
+
+class ScriptPolicy:
+    """
+    Replays actions from a file, one per line: "move <dx> <dy>", "pickup" or "wait". The script loops once it runs out.
+    """
+
+    def __init__(self, path):
+        self.actions = []
+        with open(path) as script_file:
+            for line in script_file:
+                words = line.split()
+                if not words:
+                    continue
+                elif words[0] == 'move':
+                    self.actions.append({'move': (int(words[1]), int(words[2]))})
+                elif words[0] in ('pickup', 'wait'):
+                    self.actions.append({words[0]: True})
+                else:
+                    raise ValueError('Unknown action: {0}'.format(line.strip()))
+        self.index = 0
+
+    def next_action(self, turn_engine):
+        action = self.actions[self.index % len(self.actions)]
+        self.index += 1
+        return action
+
+
+def simulate(policy, turns, seed=None, timer=NULL_TIMER):
+    # Plays games with no console until the player has taken the given number of turns, starting a new game whenever
+    # one ends, and returns the statistics of the run
+    stats = {'turns': 0, 'actions': 0, 'events': 0, 'games': 0, 'deaths': 0, 'victories': 0, 'deepest_level': 1}
+
+    seed_game(seed)
+    start_time = time.perf_counter()
+
+    while stats['turns'] < turns:
+        turn_engine = TurnEngine(timer=timer)
+        stats['games'] += 1
+
+        # Turns taken in the games before this one
+        previous_turns = stats['turns']
+
+        # Actions taken since the player last used up a turn, such as walking into walls
+        idle_actions = 0
+
+        while previous_turns + turn_engine.turns < turns:
+            turn_engine.update_fov()
+            if turn_engine.game_state is not GameStates.PLAYER_TURN:
+                break
+
+            action = policy.next_action(turn_engine)
+            with timer.phase('turn'):
+                events = turn_engine.act(action)
+
+            stats['actions'] += 1
+            stats['events'] += len(events)
+            stats['deepest_level'] = max(stats['deepest_level'], turn_engine.game_map.dungeon_level)
+
+            if any(event_type is EventTypes.TURN for event_type, _ in events):
+                idle_actions = 0
+            else:
+                idle_actions += 1
+                if idle_actions >= MAX_IDLE_ACTIONS:
+                    raise RuntimeError('{0} actions in a row took no turn, last of all {1}'.format(idle_actions,
+                                                                                                  action))
+
+        turn_engine.close()
+
+        stats['turns'] = previous_turns + turn_engine.turns
+        if turn_engine.game_state is GameStates.PLAYER_DEAD:
+            stats['deaths'] += 1
+        elif turn_engine.game_state is GameStates.VICTORY:
+            stats['victories'] += 1
+
+    stats['seconds'] = time.perf_counter() - start_time
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plays GeneriCrawl with no window and reports turns per second')
+    parser.add_argument('--turns', type=int, default=1000, help='number of player turns to simulate')
+    parser.add_argument('--seed', help='seed for the game and the bot')
+    parser.add_argument('--script', help='file of actions to replay instead of playing with the bot')
+    parser.add_argument('--timing-file', help='file to append per-phase turn timings to')
+    args = parser.parse_args()
+
+    policy = ScriptPolicy(args.script) if args.script else BotPolicy(args.seed)
+    timer = PhaseTimer(TIMING_WINDOW) if args.timing_file else NULL_TIMER
+    stats = simulate(policy, args.turns, args.seed, timer)
+
+    print('{turns} turns ({actions} actions, {events} events) in {seconds:.2f} s: {0:.1f} turns per second'.format(
+        stats['turns'] / stats['seconds'], **stats))
+    print('{games} games, {deaths} deaths, {victories} victories, deepest level {deepest_level}'.format(**stats))
+
+    if args.timing_file:
+        timer.dump(args.timing_file)
+
+
+if __name__ == '__main__':
+    main()
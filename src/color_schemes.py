@@ -4,6 +4,11 @@ import libtcodpy as libtcod
 from libtcodpy import Color
 from src.map.tile import Tiles
 
+# Tiles in the player's FOV are brightened by up to max brightness near the player, and darkened further away, over a
+# total range of brightness
+FOV_BRIGHTNESS_RANGE = 32
+FOV_MAX_BRIGHTNESS = 16
+
 
 def generate_tile_dict(room_floor, room_wall, corridor_floor, corridor_wall, cave_floor, cave_wall, door, room_stairs,
                        cave_stairs, unknown=libtcod.black):
@@ -25,6 +30,13 @@ def generate_monochrome_dict(color):
     return generate_tile_dict(color, color, color, color, color, color, color, color, color)
 
 
+def change_brightness(color, mod):
+    if mod > 0:
+        return color.__add__(Color(mod, mod, mod))
+    else:
+        return color.__sub__(Color(-mod, -mod, -mod))
+
+
 def color_dict_change_brightness(color_dict, mod):
     copy = color_dict.copy()
     for key in copy.keys():
@@ -59,6 +71,20 @@ class ColorScheme:
     def get_memory_color(self, color):
         return color.__sub__(Color(self.memory_brightness_mod, self.memory_brightness_mod, self.memory_brightness_mod))
 
+    def init_shades(self, brightness_range=FOV_BRIGHTNESS_RANGE, max_brightness=FOV_MAX_BRIGHTNESS):
+        # Precomputes every color a tile can be drawn in, so that no colors are created while rendering
+        # Shades are ordered from the tiles nearest the player, which are brightest, to the furthest
+        # Lit walls in the corners of the FOV can be up to sqrt(2) times the FOV radius away, hence twice the range
+        shade_mods = range(max_brightness, max_brightness - 2 * brightness_range - 1, -1)
+
+        self.foreground_shades = {tile: [change_brightness(color, mod) for mod in shade_mods]
+                                  for tile, color in self.foreground.items()}
+        self.background_shades = {tile: [change_brightness(color, mod) for mod in shade_mods]
+                                  for tile, color in self.background.items()}
+
+        self.foreground_memory = {tile: self.get_memory_color(color) for tile, color in self.foreground.items()}
+        self.background_memory = {tile: self.get_memory_color(color) for tile, color in self.background.items()}
+
 
 class ColorSchemes(Enum):
     CLASSIC = ColorScheme('Classic', foreground=generate_monochrome_dict(libtcod.lightest_gray), background=None,
@@ -86,3 +112,4 @@ def init_color_schemes():
     for scheme in ColorSchemes:
         scheme.value.foreground = set_tile_color(scheme.value.foreground, Tiles.ROOM_STAIRS, libtcod.white)
         scheme.value.foreground = set_tile_color(scheme.value.foreground, Tiles.CAVE_STAIRS, libtcod.white)
+        scheme.value.init_shades()
@@ -1,5 +1,8 @@
-import libtcodpy as libtcod
-from random import randint
+from src.rng import ai_random
+
+# The greatest path cost to the player at which an entity will still chase them. Straight steps cost 1 and diagonal
+# steps 1.41, as in the overlay's flow field, so this reaches 25 straight steps but only about 17 diagonal ones
+MAX_CHASE_COST = 25
 
 
 class BasicMonster:
@@ -8,7 +11,7 @@ class BasicMonster:
         self.chase_duration = chase_duration
         self.remaining_chase_turns = 0
 
-    def act(self, game_map, player, fov_map=None, has_los=None):
+    def act(self, game_map, player, has_los):
         dist = self.owner.distance_to(player)
 
         if dist < 2:
@@ -16,7 +19,7 @@ class BasicMonster:
             return self.owner.fighter.attack_entity(player.fighter, target_is_player=True)
 
         results = {}
-        given_fov_map = fov_map is not None
+        overlay = game_map.overlay
 
         if self.owner.sight and dist <= self.owner.sight.fov_radius or self.remaining_chase_turns > 0:
             owner_x = self.owner.x
@@ -24,22 +27,10 @@ class BasicMonster:
             player_x = player.x
             player_y = player.y
 
-            if given_fov_map:
-                libtcod.map_set_properties(fov_map, owner_x, owner_y, True, True)
-                libtcod.map_set_properties(fov_map, player_x, player_y, True, True)
-            else:
-                # This second variable is necessary as creating another variable called fov_map might shadow the
-                # parameter rather than changing its value
-                fov_map = game_map.generate_fov_map_with_entities([self.owner, player])
-
             if self.clairvoyant:
                 # Clairvoyant entities can always sense the player when they're nearby
                 has_los = True
 
-            if has_los is None:
-                self.owner.sight.get_fov(fov_map)
-                has_los = libtcod.map_is_in_fov(fov_map, owner_x, owner_y)
-
             if has_los:
                 # If the entity can see the player, reset the chase timer
                 self.remaining_chase_turns = self.chase_duration
@@ -52,14 +43,11 @@ class BasicMonster:
                 self.remaining_chase_turns -= 1
 
             if chase:
-                # 1.41 approximates sqrt(2), the cost of a diagonal moves
-                path = libtcod.path_new_using_map(fov_map, 1.41)
-                libtcod.path_compute(path, owner_x, owner_y, player_x, player_y)
-
-                if not libtcod.path_is_empty(path) and libtcod.path_size(path) < 25:
-                    x, y = libtcod.path_walk(path, True)
-                    if x or y:
-                        self.owner.move_to(x, y, game_map, face=True)
+                # The overlay's flow field leads to the player, and is shared by every chasing entity
+                step = overlay.get_flow_step(owner_x, owner_y, MAX_CHASE_COST)
+
+                if step:
+                    self.owner.move_to(*step, game_map, face=True)
                 else:
                     dx = player_x - owner_x
                     dy = player_y - owner_y
@@ -69,24 +57,12 @@ class BasicMonster:
 
                     if game_map.is_tile_open(owner_x + dx, owner_y + dy):
                         self.owner.move(dx, dy, game_map)
-
-                libtcod.path_delete(path)
-
-            if given_fov_map:
-                libtcod.map_set_properties(fov_map, self.owner.x, self.owner.y, True, False)
-                libtcod.map_set_properties(fov_map, player.x, player.y, True, False)
-            else:
-                libtcod.map_delete(fov_map)
         else:
-            if given_fov_map:
-                # Remove the entity from the given FOV map
-                libtcod.map_set_properties(fov_map, self.owner.x, self.owner.y, True, True)
-
-            # Wander around aimlessly
-            self.owner.move(randint(-1, 1), randint(-1, 1), game_map)
-
-            if given_fov_map:
-                # Add the entity to the given FOV map
-                libtcod.map_set_properties(fov_map, self.owner.x, self.owner.y, True, False)
+            self.wander(game_map)
 
         return results
+
+    def wander(self, game_map, turns=1):
+        # Wander around aimlessly
+        for i in range(turns):
+            self.owner.move(ai_random.randint(-1, 1), ai_random.randint(-1, 1), game_map)
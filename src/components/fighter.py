@@ -1,13 +1,13 @@
 import libtcodpy as libtcod
-from random import random, getrandbits, randint
 
 from src.game_messages import Message
+from src.rng import combat_random
 
 
 def calc_hit_chance(attack, defense):
     if attack <= 0:
         if defense <= 0:
-            return bool(getrandbits(1))
+            return bool(combat_random.getrandbits(1))
         else:
             return False
 
@@ -16,12 +16,12 @@ def calc_hit_chance(attack, defense):
 
     chance = attack / defense / 2
     clamped_chance = max(0, min(1, chance))
-    return random() < clamped_chance
+    return combat_random.random() < clamped_chance
 
 
 def calc_damage(damage):
     max_variation = max(1, int(damage / 4))
-    variation = randint(-max_variation, max_variation)
+    variation = combat_random.randint(-max_variation, max_variation)
     return max(1, damage + variation)
 
 
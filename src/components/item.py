@@ -339,7 +339,7 @@ def teleportation(*args, **kwargs):
 
     player_using = target == args[0]
 
-    target.x, target.y = game_map.find_open_tile()
+    game_map.move_entity(target, *game_map.find_open_tile())
 
     results = {'item_consumed': item}
     if player_using:
@@ -378,11 +378,10 @@ def digging(*args, **kwargs):
             for x in range(target_x - 1, target_x + 2):
                 for y in range(target_y - 1, target_y + 2):
                     if game_map.contains(x, y):
-                        game_map.generator.grid[x][y] = CAVE_FLOOR
+                        game_map.set_tile(x, y, CAVE_FLOOR)
 
             return {'use_message': Message('The walls collapse around the {0}.'.format(item.definite_name),
-                                           libtcod.orange), 'item_consumed': item, 'update_fov_map': True,
-                    'recompute_fov': True}
+                                           libtcod.orange), 'item_consumed': item, 'recompute_fov': True}
 
     player_using = target == args[0]
 
@@ -394,7 +393,7 @@ def digging(*args, **kwargs):
     else:
         results['use_message'] = Message('The ground beneath {0} collapses.'.format(target.definite_name),
                                          libtcod.orange)
-        game_map.entities.remove(target)
+        game_map.remove_entity(target)
 
     return results
 
@@ -437,7 +436,6 @@ def replication(*args, **kwargs):
         clone.fighter.base_damage = clone.fighter.damage
         clone.slots = None
 
-        game_map.entities.append(clone)
         for x in range(target.x - 1, target.x + 2):
             for y in range(target.y - 1, target.y + 2):
                 if game_map.is_tile_open(x, y):
@@ -453,7 +451,6 @@ def replication(*args, **kwargs):
     else:
         clone = deepcopy(target)
 
-        game_map.entities.append(clone)
         for x in range(target.x - 1, target.x + 2):
             for y in range(target.y - 1, target.y + 2):
                 if game_map.is_tile_open(x, y):
@@ -467,6 +464,9 @@ def replication(*args, **kwargs):
             clone.x, clone.y = game_map.find_open_tile()
             results['use_message'] = Message('You feel a vague hostile presence.', libtcod.yellow)
 
+    # The clone is only added to the map once its position is final
+    game_map.add_entity(clone)
+
     return results
 
 
@@ -23,6 +23,10 @@ class Sight:
         self.facing = facing
         return True
 
+    def can_see(self, x, y):
+        # Only checks range; line of sight must be checked separately
+        return distance(self.owner.x, self.owner.y, x, y) <= self.fov_radius
+
     def get_fov(self, fov_map, memory=None):
         compute_fov(fov_map, self.owner.x, self.owner.y, self.fov_radius, memory=memory)
 
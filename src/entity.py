@@ -75,8 +75,7 @@ class Entity:
         if game_map.is_tile_open(x, y):
             if face and self.sight:
                 self.sight.face(atan2(y - self.y, x - self.x))
-            self.x = x
-            self.y = y
+            game_map.move_entity(self, x, y)
             return True
         return False
 
@@ -1,5 +1,4 @@
 from enum import Enum
-from random import randint
 
 from src.components.ai import BasicMonster
 from src.components.equipment import Equipment
@@ -9,6 +8,7 @@ from src.components.sight import Sight
 from src.components.slots import SlotTypes
 from src.entity import Entity
 from src.render import RenderOrder
+from src.rng import spawn_random
 
 
 def create_enemy(char, color, name, hp, defense, attack, damage, is_name_proper=False, fov_radius=8):
@@ -188,7 +188,7 @@ ITEM_WEIGHTS = {
 
 def weighted_choice(weights):
     weight_list = list(weights.values())
-    selection = randint(1, sum(weight_list))
+    selection = spawn_random.randint(1, sum(weight_list))
 
     weight_index = 0
     choice_index = 0
@@ -1,6 +1,113 @@
 import libtcodpy as libtcod
+from ctypes import Structure, c_int, c_void_p, memmove, string_at
+from functools import lru_cache
 from math import atan2, cos, pi, sin, sqrt
 
+# The flags stored in each cell of a libtcod map
+CELL_TRANSPARENT = 1
+CELL_WALKABLE = 2
+CELL_IN_FOV = 4
+
+# Translates libtcod map cells to 1 if they are in FOV and 0 otherwise, for use with bytes.translate
+IN_FOV_TABLE = bytes(1 if cell & CELL_IN_FOV else 0 for cell in range(256))
+
+
+class MapData(Structure):
+    """
+    The layout of a map in memory in the libtcod 1.6 and 1.7 sources, which the bundled 1.7.0 library is built from.
+    Cells are stored row by row, one byte each, which allows a whole map to be read or written in a single call rather
+    than one ctypes call per cell.
+
+    Later versions store each cell as three separate bools, and a libtcod.so supplied by the player may be any version,
+    so the layout is checked by probe_map_layout() before it is relied on.
+    """
+
+    _fields_ = [('width', c_int), ('height', c_int), ('nb_cells', c_int), ('cells', c_void_p)]
+
+
+def probe_map_layout():
+    # Whether this libtcod's maps are laid out as in MapData, checked by writing known properties to a small map through
+    # libtcod and reading them back directly, then the other way around
+    width, height = 4, 2
+    fov_map = libtcod.map_new(width, height)
+    try:
+        data = MapData.from_address(fov_map)
+
+        # The cells pointer is only followed once the fields before it are known to hold what they should
+        if (data.width, data.height, data.nb_cells) != (width, height, width * height) or not data.cells:
+            return False
+
+        expected = bytearray(width * height)
+        for i in range(width * height):
+            x, y = i % width, i // width
+            libtcod.map_set_properties(fov_map, x, y, i & 1, i & 2)
+            libtcod.map_set_in_fov(fov_map, x, y, i & 4)
+            expected[i] = i & (CELL_TRANSPARENT | CELL_WALKABLE | CELL_IN_FOV)
+
+        if string_at(data.cells, data.nb_cells) != expected:
+            return False
+
+        memmove(data.cells, bytes(cell ^ 0x07 for cell in expected), data.nb_cells)
+        for i in range(width * height):
+            x, y = i % width, i // width
+            if (bool(libtcod.map_is_transparent(fov_map, x, y)) == bool(i & 1) or
+                    bool(libtcod.map_is_walkable(fov_map, x, y)) == bool(i & 2) or
+                    bool(libtcod.map_is_in_fov(fov_map, x, y)) == bool(i & 4)):
+                return False
+
+        return True
+    finally:
+        libtcod.map_delete(fov_map)
+
+
+# Whether map cells can be read and written in bulk; otherwise libtcod is called for each cell
+RAW_MAP_CELLS = probe_map_layout()
+
+
+def get_map_cells(fov_map):
+    # Returns the cells of the map row by row, one byte of CELL_ flags each
+    if RAW_MAP_CELLS:
+        data = MapData.from_address(fov_map)
+        return string_at(data.cells, data.nb_cells)
+
+    width = libtcod.map_get_width(fov_map)
+    height = libtcod.map_get_height(fov_map)
+    return bytes((CELL_TRANSPARENT if libtcod.map_is_transparent(fov_map, x, y) else 0) |
+                 (CELL_WALKABLE if libtcod.map_is_walkable(fov_map, x, y) else 0) |
+                 (CELL_IN_FOV if libtcod.map_is_in_fov(fov_map, x, y) else 0)
+                 for y in range(height) for x in range(width))
+
+
+def set_map_cells(fov_map, cells):
+    # Sets every cell of the map from one byte of CELL_ flags each, row by row
+    if RAW_MAP_CELLS:
+        data = MapData.from_address(fov_map)
+        memmove(data.cells, bytes(cells), data.nb_cells)
+        return
+
+    width = libtcod.map_get_width(fov_map)
+    for i, cell in enumerate(cells):
+        x, y = i % width, i // width
+        libtcod.map_set_properties(fov_map, x, y, bool(cell & CELL_TRANSPARENT), bool(cell & CELL_WALKABLE))
+        libtcod.map_set_in_fov(fov_map, x, y, bool(cell & CELL_IN_FOV))
+
+
+def get_fov_cells(fov_map):
+    # Returns the FOV of the map as one byte per tile, row by row, each 1 if the tile is in FOV and 0 otherwise
+    if RAW_MAP_CELLS:
+        return get_map_cells(fov_map).translate(IN_FOV_TABLE)
+
+    width = libtcod.map_get_width(fov_map)
+    height = libtcod.map_get_height(fov_map)
+    return bytes(1 if libtcod.map_is_in_fov(fov_map, x, y) else 0 for y in range(height) for x in range(width))
+
+
+def remember_fov(fov_map, memory):
+    # memory is a bytearray laid out like the map, and every tile in FOV is marked in it with one bitwise or over the
+    # whole map, rather than a call to libtcod for each tile where the map's cells can be read in bulk
+    fov_cells = int.from_bytes(get_fov_cells(fov_map), 'little')
+    memory[:] = (int.from_bytes(memory, 'little') | fov_cells).to_bytes(len(memory), 'little')
+
 
 def distance(x1, y1, x2, y2):
     dx = x1 - x2
@@ -8,21 +115,17 @@ def distance(x1, y1, x2, y2):
     return sqrt(dx ** 2 + dy ** 2)
 
 
-def compute_fov(fov_map, x, y, radius, light_walls=True, algorithm=0, memory=None):
-    libtcod.map_compute_fov(fov_map, x, y, radius, light_walls, algorithm)
-
-    if memory is not None:
-        # Must use "is not None" because [] also evaluates to False
-        for xi in range(x - radius, x + radius):
-            for yi in range(y - radius, y + radius):
-                if libtcod.map_is_in_fov(fov_map, xi, yi):
-                    memory[xi][yi] = True
-
+@lru_cache(maxsize=None)
+def get_angle_table(radius):
+    # The angle from the center of a square of the given radius to each of its tiles, row by row
+    return tuple(atan2(y_rel, x_rel) for y_rel in range(-radius, radius + 1) for x_rel in range(-radius, radius + 1))
 
-def compute_fov_angled(fov_map, x, y, radius, angle, span, light_walls=True, algorithm=0, memory=None,
-                       reveal_sides=True):
-    compute_fov(fov_map, x, y, radius, light_walls, algorithm)
 
+@lru_cache(maxsize=None)
+def get_cone_mask(radius, angle, span):
+    # Returns the rows of a mask over a square of the given radius. ANDing it with map cells clears the FOV of every
+    # tile outside of the cone and leaves the tiles inside it untouched. Masks are cached, since entities only ever face
+    # a handful of directions
     angle1 = angle - span / 2.0
     angle2 = angle + span / 2.0
 
@@ -38,21 +141,58 @@ def compute_fov_angled(fov_map, x, y, radius, angle, span, light_walls=True, alg
     greater_angle = max(angle1, angle2)
     lesser_angle = min(angle1, angle2)
 
-    for xi in range(x - radius, x + radius):
-        for yi in range(y - radius, y + radius):
-            if libtcod.map_is_in_fov(fov_map, xi, yi):
-                x_rel = xi - x
-                y_rel = yi - y
-                tile_angle = atan2(y_rel, x_rel)
+    outside = 0xFF ^ CELL_IN_FOV
+    inside = 0xFF
+    mask = bytes(outside if swap_angles == (lesser_angle <= tile_angle <= greater_angle) else inside
+                 for tile_angle in get_angle_table(radius))
+
+    size = 2 * radius + 1
+    return tuple(mask[i:i + size] for i in range(0, len(mask), size))
 
-                if swap_angles == (lesser_angle <= tile_angle <= greater_angle):
-                    libtcod.map_set_in_fov(fov_map, xi, yi, False)
-                elif memory is not None:
-                    # Must use "is not None" because [] also evaluates to False
-                    memory[xi][yi] = True
+
+def compute_fov(fov_map, x, y, radius, light_walls=True, algorithm=0, memory=None):
+    libtcod.map_compute_fov(fov_map, x, y, radius, light_walls, algorithm)
+
+    if memory is not None:
+        # Must use "is not None" because an empty bytearray also evaluates to False
+        remember_fov(fov_map, memory)
+
+
+def compute_fov_angled(fov_map, x, y, radius, angle, span, light_walls=True, algorithm=0, memory=None,
+                       reveal_sides=True):
+    compute_fov(fov_map, x, y, radius, light_walls, algorithm)
+
+    width = libtcod.map_get_width(fov_map)
+    height = libtcod.map_get_height(fov_map)
+
+    # The range of columns of the cone's square that fall within the map
+    first_x = max(0, x - radius)
+    last_x = min(width, x + radius + 1)
+    mask_start = first_x - (x - radius)
+    mask_end = last_x - (x - radius)
+
+    if RAW_MAP_CELLS:
+        cells = bytearray(get_map_cells(fov_map))
+
+        # Apply the cone's mask to the FOV one row at a time
+        for mask_row, yi in zip(get_cone_mask(radius, angle, span), range(y - radius, y + radius + 1)):
+            if 0 <= yi < height:
+                row_start = yi * width
+                row = cells[row_start + first_x:row_start + last_x]
+                row_mask = mask_row[mask_start:mask_end]
+                cells[row_start + first_x:row_start + last_x] = \
+                    (int.from_bytes(row, 'little') & int.from_bytes(row_mask, 'little')).to_bytes(len(row), 'little')
+
+        set_map_cells(fov_map, cells)
+    else:
+        # Clear the FOV of each tile the mask clears, one call to libtcod at a time, leaving its other properties alone
+        for mask_row, yi in zip(get_cone_mask(radius, angle, span), range(y - radius, y + radius + 1)):
+            if 0 <= yi < height:
+                for xi, mask in zip(range(first_x, last_x), mask_row[mask_start:mask_end]):
+                    if not mask & CELL_IN_FOV:
+                        libtcod.map_set_in_fov(fov_map, xi, yi, False)
 
     libtcod.map_set_in_fov(fov_map, x, y, True)
-    memory[x][y] = True
 
     if reveal_sides:
         # Ideal, angle-based approach (some issues with signs result in incorrect
@@ -86,5 +226,6 @@ def compute_fov_angled(fov_map, x, y, radius, angle, span, light_walls=True, alg
         libtcod.map_set_in_fov(fov_map, x + left_x, y + left_y, True)
         libtcod.map_set_in_fov(fov_map, x + right_x, y + right_y, True)
 
-        memory[x + left_x][y + left_y] = True
-        memory[x + right_x][y + right_y] = True
+    if memory is not None:
+        # Must use "is not None" because an empty bytearray also evaluates to False
+        remember_fov(fov_map, memory)
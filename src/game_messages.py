@@ -1,6 +1,10 @@
 import libtcodpy as libtcod
 
 import textwrap
+from collections import deque
+
+# The most messages kept in memory; older ones are dropped, or written to the log's spill file if it has one
+MESSAGE_CAPACITY = 200
 
 
 def join_list(terms):
@@ -18,18 +22,75 @@ class Message:
         self.text = text
         self.color = color
 
+        # How many identical messages in a row this message stands for
+        self.count = 1
+
+        # Maps each width the message has been displayed at to its wrapped lines
+        self.wrapped_lines = {}
+
+    @property
+    def display_text(self):
+        if self.count > 1:
+            return '{0} (x{1})'.format(self.text, self.count)
+        return self.text
+
+    def repeat(self):
+        self.count += 1
+        self.wrapped_lines.clear()
+
+    def wrap(self, width):
+        lines = self.wrapped_lines.get(width)
+        if lines is None:
+            lines = textwrap.wrap(self.display_text, width)
+            self.wrapped_lines[width] = lines
+        return lines
+
 
 class MessageLog:
-    def __init__(self, x, width, height):
-        self.messages = []
+    """
+    A fixed number of the most recent messages. Messages are only split into lines when they are displayed, since only
+    the last few lines are ever shown, and a message identical to the one before it is counted rather than added again.
+    """
+
+    def __init__(self, x, width, height, capacity=MESSAGE_CAPACITY, spill_file=None):
+        self.messages = deque(maxlen=capacity)
         self.x = x
         self.width = width
         self.height = height
+        self.spill_file = spill_file
+
+        # The spill file stays open from the first message written to it until the log is closed
+        self.spill_handle = None
 
     def add_message(self, message):
-        # Split the message if necessary, among multiple lines
-        new_msg_lines = textwrap.wrap(message.text, self.width)
+        if self.messages:
+            last_message = self.messages[-1]
+            if last_message.text == message.text and last_message.color == message.color:
+                last_message.repeat()
+                return
+
+        if self.spill_file and len(self.messages) == self.messages.maxlen:
+            # Keep the oldest message on disk before it is pushed out
+            if self.spill_handle is None:
+                self.spill_handle = open(self.spill_file, 'a')
+            self.spill_handle.write(self.messages[0].display_text + '\n')
+
+        self.messages.append(message)
+
+    def close(self):
+        if self.spill_handle is not None:
+            self.spill_handle.close()
+            self.spill_handle = None
+
+    def get_lines(self, count):
+        # Returns the last count lines of the log as (text, color) pairs, wrapping only the messages they come from
+        if count <= 0:
+            return []
+
+        lines = []
+        for message in reversed(self.messages):
+            if len(lines) >= count:
+                break
+            lines[:0] = [(line, message.color) for line in message.wrap(self.width)]
 
-        for line in new_msg_lines:
-            # Add the new line as a Message object, with the text and the color
-            self.messages.append(Message(line, message.color))
\ No newline at end of file
+        return lines[-count:]
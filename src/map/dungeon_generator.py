@@ -13,7 +13,8 @@
 ##################################################################
 
 
-from random import randint, choice, randrange
+import random
+from bisect import bisect_left
 
 #tile constants (edited to include more wall variants)
 EMPTY = 0
@@ -90,6 +91,7 @@ class dungeonGenerator:
      
     Args:
         height and width of the dungeon to be generated
+        rng: the source of randomness, anything with the interface of the random module (such as a random.Random)
          
     Attributes:
         width: size of the dungeon in the x dimension
@@ -99,13 +101,16 @@ class dungeonGenerator:
         doors: **list of all grid coordinates of the corridor to room connections, elements are tuples (x,y), empty until connectAllRooms() is called
         corridors: **list of all the corridor tiles in the grid, elements are tuples (x,y), empty until generateCorridors() is called
         deadends: list of all corridor tiles only connected to one other tile, elements are tuples (x,y), empty until findDeadends() is called
+        unjoinedAreas: list of the areas joinUnconnectedAreas() could not join to any other, each a list of (x,y) tuples, empty until joinUnconnectedAreas() is called
+        rng: the source of randomness used for generation
         graph: dictionary where keys are the coordinates of all floor/corridor tiles and values are a list of floor/corridor directly connected, ie (x, y): [(x+1, y), (x-1, y), (x, y+1), (x, y-1)], empty until constructGraph() is called
          
         ** once created these will not be re-instanced, therefore any user made changes to grid will also need to update these lists for them to remain valid
     """
 
-    def __init__(self, height, width):
+    def __init__(self, height, width, rng=random):
 
+        self.rng = rng
         self.height = abs(height)
         self.width = abs(width)
         #self.grid = [[EMPTY for i in range(self.width)] for i in range(self.height)]
@@ -114,6 +119,7 @@ class dungeonGenerator:
         self.doors = []
         self.corridors = []
         self.deadends = []
+        self.unjoinedAreas = []
 
         self.graph = {}
 
@@ -262,31 +268,115 @@ class dungeonGenerator:
 
     ##### LEVEL SEARCH FUNCTIONS #####
 
-    def findEmptySpace(self, distance):
+    def findEmptySpace(self, distance, startX = None, startY = None):
         """
         Finds the first empty space encountered in the 2D grid that it not surrounding by anything within the given distance
+        Edited to skip past every position a filled cell rules out, and to optionally resume a previous search
          
         Args:
             distance: integer, the distance from the current x,y point being checked to see if is empty
+            startX and startY: integer, the point to resume searching from, usually the last space found
+                               only valid if no cells have been emptied since, as the spaces before it can then still not be empty
              
         Returns:
             the x,y indicies of the free space or None, None if no space was found
         """
 
-        for x in range(distance, self.width - distance):
-            for y in range(distance, self.height - distance):
-                touching = 0
-                for xi in range(-distance, distance):
-                    for yi in range(-distance, distance):
-                        if self.grid[x+xi][y+yi]: touching += 1
-                if not touching:
+        if startX is None:
+            startX, startY = distance, distance
+        for x in range(startX, self.width - distance):
+            columns = self.grid[x-distance:x+distance]
+            y = startY if x == startX else distance
+            while y < self.height - distance:
+                # Looks for the last filled row within distance, as the spaces up to distance past it can't be empty either
+                blocked = None
+                for yi in range(y+distance-1, y-distance-1, -1):
+                    for column in columns:
+                        if column[yi]:
+                            blocked = yi
+                            break
+                    if blocked is not None:
+                        break
+                if blocked is None:
                     return x, y
+                y = blocked + distance + 1
         return None, None
 
+    def labelAreas(self):
+        """
+        Labels each island/unconnected room with a two-pass union-find, in a single scan of the grid plus a relabelling pass
+        Areas are numbered, and their cells listed, in the order the grid is scanned (by column, then by row)
+
+        Args:
+            none
+
+        Returns:
+            labels: list[[]], a 2D array the same shape as the grid, where each cell holds the number of its area (from 1), or 0 if it is empty
+            areas: a list of each area's cells, where areas[label - 1] holds the cells labelled label, each cell indice stored as a tuple
+        """
+
+        labels = [[0] * self.height for i in range(self.width)]
+
+        # Provisional labels are merged whenever they meet, always keeping the smallest as the root
+        # Label 0 is reserved for empty cells
+        parents = [0]
+
+        def findRoot(label):
+            root = label
+            while parents[root] != root:
+                root = parents[root]
+            while parents[label] != root:
+                parents[label], label = root, parents[label]
+            return root
+
+        # First pass: give each cell the label of its left or upper neighbour, merging the two if they differ
+        previousLabels = None
+        for x in range(self.width):
+            column = self.grid[x]
+            columnLabels = labels[x]
+            for y in range(self.height):
+                if not column[y]:
+                    continue
+
+                up = columnLabels[y-1] if y else 0
+                left = previousLabels[y] if previousLabels else 0
+                if up and left:
+                    columnLabels[y] = up
+                    upRoot = findRoot(up)
+                    leftRoot = findRoot(left)
+                    if upRoot < leftRoot:
+                        parents[leftRoot] = upRoot
+                    elif leftRoot < upRoot:
+                        parents[upRoot] = leftRoot
+                elif up or left:
+                    columnLabels[y] = up or left
+                else:
+                    columnLabels[y] = len(parents)
+                    parents.append(len(parents))
+            previousLabels = columnLabels
+
+        # Second pass: number each area by the first of its cells to be scanned, and collect its cells
+        areas = []
+        finalLabels = [0] * len(parents)
+        for x in range(self.width):
+            columnLabels = labels[x]
+            for y in range(self.height):
+                label = columnLabels[y]
+                if not label:
+                    continue
+
+                root = findRoot(label)
+                finalLabel = finalLabels[root]
+                if not finalLabel:
+                    areas.append([])
+                    finalLabel = finalLabels[root] = len(areas)
+                columnLabels[y] = finalLabel
+                areas[finalLabel-1].append((x,y))
+        return labels, areas
+
     def findUnconnectedAreas(self):
         """
         Checks through the grid to find islands/unconnected rooms
-        Note, this can be slow for large grids and memory intensive since it needs to create a deep copy of the grid
         in order to use joinUnconnectedAreas() this needs to be called first and the returned list passed to joinUnconnectedAreas()
          
         Args:
@@ -296,26 +386,8 @@ class dungeonGenerator:
             A list of unconnected cells, where each group of cells is in its own list and each cell indice is stored as a tuple, ie [[(x1,y1), (x2,y2), (x3,y3)], [(xi1,yi1), (xi2,yi2), (xi3,yi3)]] 
         """
 
-        unconnectedAreas = []
-        areaCount = 0
-        # Edited here to fix incorrectly swapped width/height
-        gridCopy = [[EMPTY for i in range(self.height)] for i in range(self.width)]
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.grid[x][y]:
-                    gridCopy[x][y] = 'x'
-        for x in range(self.width):
-            for y in range(self.height):
-                if gridCopy[x][y] == 'x':
-                    unconnectedAreas.append([])
-                    areaCount += 1
-                    self.floodFill(x, y, areaCount, None, gridCopy)
-        for x in range(self.width):
-            for y in range(self.height):
-                if gridCopy[x][y]:
-                    i = gridCopy[x][y]
-                    unconnectedAreas[i-1].append((x,y))
-        return unconnectedAreas
+        # Edited to label areas in a single pass rather than flood filling a copy of the grid
+        return self.labelAreas()[1]
 
     def findDeadends(self):
         """
@@ -377,10 +449,10 @@ class dungeonGenerator:
         """
 
         for attempt in range(attempts):
-            roomWidth = randrange(minRoomSize, maxRoomSize, roomStep)
-            roomHeight = randrange(minRoomSize, maxRoomSize, roomStep)
-            startX = randint(0, self.width)
-            startY = randint(0, self.height)
+            roomWidth = self.rng.randrange(minRoomSize, maxRoomSize, roomStep)
+            roomHeight = self.rng.randrange(minRoomSize, maxRoomSize, roomStep)
+            startX = self.rng.randint(0, self.width)
+            startY = self.rng.randint(0, self.height)
             if self.quadFits(startX, startY, roomWidth, roomHeight, margin):
                 for x in range(roomWidth):
                     for y in range(roomHeight):
@@ -390,6 +462,8 @@ class dungeonGenerator:
     def generateCaves(self, p = 45, smoothing = 4):
         """
         Generates more organic shapes using cellular automata
+        Edited to smooth a whole column of cells at a time, with each column held as a bitboard (one bit per cell), see smoothColumn()
+        The caves generated are exactly the same as when each cell was smoothed in turn
          
         Args:
             p: the probability that a cell will become a cave section, values between 30 and 45 work well
@@ -401,21 +475,85 @@ class dungeonGenerator:
 
         for x in range(self.width):
             for y in range(self.height):
-                if randint(0, 100) < p:
+                if self.rng.randint(0, 100) < p:
                     self.grid[x][y] = CAVE_FLOOR
+
+        columns = [sum(1 << y for y in range(self.height) if self.grid[x][y] == CAVE_FLOOR) for x in range(self.width)]
+        cleared = [0] * self.width
         for i in range(smoothing):
+            # Columns before x have already been smoothed in this pass, and columns after it have not
             for x in range(self.width):
-                for y in range(self.height):
-                    if x == 0 or x == self.width or y == 0 or y == self.height:
-                        self.grid[x][y] = EMPTY
-                    touchingEmptySpace = 0
-                    for nx, ny in self.findNeighbours(x,y):
-                        if self.grid[nx][ny] == CAVE_FLOOR:
-                            touchingEmptySpace += 1
-                    if touchingEmptySpace >= 5:
-                        self.grid[x][y] = CAVE_FLOOR
-                    elif touchingEmptySpace <= 2:
-                       self.grid[x][y] = EMPTY
+                left = columns[x-1] if x > 0 else 0
+                right = columns[x+1] if x < self.width - 1 else 0
+                columns[x], columnCleared = self.smoothColumn(left, columns[x], right, x == 0)
+                cleared[x] |= columnCleared
+
+        for x in range(self.width):
+            for y in range(self.height):
+                if columns[x] >> y & 1:
+                    self.grid[x][y] = CAVE_FLOOR
+                elif cleared[x] >> y & 1 or self.grid[x][y] == CAVE_FLOOR:
+                    self.grid[x][y] = EMPTY
+
+    def smoothColumn(self, left, column, right, firstColumn):
+        """
+        Smooths one column of cells, as generateCaves() would smooth each of its cells in turn from top to bottom
+        used by generateCaves()
+
+        Each cell's cave neighbours are counted in binary, with one bitboard per binary digit, for all cells at once
+        Cells are smoothed in turn, so the neighbour above each cell has already been smoothed, and whether that neighbour is a cave decides between 2 outcomes for the cell
+        The outcomes are chained down the column with a parallel prefix, in log2(height) steps
+
+        Args:
+            left: integer, bitboard of the caves in the column before, already smoothed
+            column: integer, bitboard of the caves in the column to smooth, bit y for the cell at y
+            right: integer, bitboard of the caves in the column after, not yet smoothed
+            firstColumn: boolean, if this is the first column, where every cell is emptied unless it becomes a cave
+
+        Returns:
+            the smoothed column's bitboard, and a bitboard of the cells emptied
+        """
+
+        mask = (1 << self.height) - 1
+
+        # The first cell of each column and every cell of the first column are emptied unless they become caves
+        border = mask if firstColumn else 1
+        kept = column & ~border
+
+        # Counts every neighbour but the one above, as 4 * fours + 2 * twos + ones
+        ones = twos = fours = 0
+        for neighbours in (left << 1, left, left >> 1, right << 1, right, right >> 1, column >> 1):
+            neighbours &= mask
+            carry = ones & neighbours
+            ones ^= neighbours
+            carry, twos = twos & carry, twos ^ carry
+            fours |= carry
+
+        # Cells with at least 5 cave neighbours become caves, those with at most 2 are emptied, and the rest are kept
+        # Outcomes when the cell above is not a cave (0), and when it is (1)
+        atLeastFive0 = fours & (twos | ones)
+        atLeastFive1 = fours
+        atMostTwo0 = ~fours & ~(twos & ones)
+        atMostTwo1 = ~fours & ~twos
+        outcome0 = (atLeastFive0 | (kept & ~atMostTwo0)) & mask
+        outcome1 = (atLeastFive1 | (kept & ~atMostTwo1)) & mask
+
+        # Composes each cell's outcomes with those of the cells above it, doubling how many cells are composed each step
+        # Cells with none above them compose with the identity, which maps 0 to 0 and 1 to 1
+        shift = 1
+        while shift < self.height:
+            above0 = (outcome0 << shift) & mask
+            above1 = ((outcome1 << shift) | ((1 << shift) - 1)) & mask
+            outcome0, outcome1 = (above0 & outcome1) | (~above0 & outcome0), (above1 & outcome1) | (~above1 & outcome0)
+            shift *= 2
+
+        # The first cell has no cell above it, so every cell's outcome follows from that cell's outcome 0
+        smoothed = outcome0 & mask
+        above = (smoothed << 1) & mask
+        atLeastFive = (above & atLeastFive1) | (~above & atLeastFive0)
+        atMostTwo = (above & atMostTwo1) | (~above & atMostTwo0)
+        emptied = ~atLeastFive & (atMostTwo | border) & mask
+        return smoothed, emptied
 
     def generateCorridors(self, mode = 'r', x = None, y = None):
         """
@@ -439,11 +577,11 @@ class dungeonGenerator:
 
         cells = []
         if not x and not y:
-            x = randint(1, self.width-2)
-            y = randint(1, self.height-2)
+            x = self.rng.randint(1, self.width-2)
+            y = self.rng.randint(1, self.height-2)
             while not self.canCarve(x, y, 0, 0):
-                x = randint(1, self.width-2)
-                y = randint(1, self.height-2)
+                x = self.rng.randint(1, self.width-2)
+                y = self.rng.randint(1, self.height-2)
         self.grid[x][y] = CORRIDOR_FLOOR
         self.corridors.append((x,y))
         cells.append((x,y))
@@ -451,17 +589,20 @@ class dungeonGenerator:
             if mode == 'l':
                 x, y = cells[-1]
             elif mode == 'r':
-                x, y = choice(cells)
+                x, y = self.rng.choice(cells)
             elif mode == 'f':
                 x, y = cells[0]
             elif mode == 'm':
                 x, y = cells[len(cells)//2]
             possMoves = self.getPossibleMoves(x, y)
             if possMoves:
-                xi, yi = choice(possMoves)
+                xi, yi = self.rng.choice(possMoves)
                 self.grid[xi][yi] = CORRIDOR_FLOOR
                 self.corridors.append((xi,yi))
                 cells.append((xi, yi))
+            elif mode == 'l':
+                # Edited; the cell is the last in the list, so it can be popped rather than searched for
+                cells.pop()
             else:
                 cells.remove((x, y))
 
@@ -541,13 +682,13 @@ class dungeonGenerator:
                 while chance <= extraDoorChance:
                     pickAgain = True
                     while pickAgain:
-                        x, y = choice(connections)
+                        x, y = self.rng.choice(connections)
                         pickAgain = False
                         for xi, yi in self.findNeighbours(x, y):
                             if self.grid[xi][yi] == DOOR:
                                 pickAgain = True
                                 break
-                    chance = randint(0, 100)
+                    chance = self.rng.randint(0, 100)
                     self.grid[x][y] = DOOR
                     self.doors.append((x, y))
             else:
@@ -559,26 +700,71 @@ class dungeonGenerator:
         Forcibly connect areas not joined together
         This will work nearly every time (I've seen one test case where an area was still unjoined)
         But it will not always produce pretty results - connecting paths may cause diagonal touching
+        Areas that share no row or column with any other remaining area cannot be joined, and are recorded in self.unjoinedAreas
+
+        Edited to find the closest pair of cells through sorted indexes of the cells in each row and column, rather than comparing every pair of cells
+        The pair found is the same: the closest, then the first in the order the areas and their cells are listed
          
         Args:
             unconnectedAreas: the list returned by findUnconnectedAreas() - ie [[(x1,y1), (x2,y2), (x3,y3)], [(xi1,yi1), (xi2,yi2), (xi3,yi3)]]
          
         Returns:
-            none
-        """
-        connections = []
+            the list of areas that could not be joined, also stored in self.unjoinedAreas
+        """
+
+        # Maps each cell of the areas not yet joined to its position in the order cells were originally compared in
+        cellOrder = {}
+        columns = {}
+        rows = {}
+        for areaIndex, area in enumerate(unconnectedAreas):
+            for cellIndex, (x, y) in enumerate(area):
+                cellOrder[(x, y)] = (areaIndex, cellIndex)
+                columns.setdefault(x, []).append(y)
+                rows.setdefault(y, []).append(x)
+        for cells in columns.values():
+            cells.sort()
+        for cells in rows.values():
+            cells.sort()
+
+        self.unjoinedAreas = []
         while len(unconnectedAreas) >= 2:
-            bestDistance = self.width + self.height
-            c = [None, None]
             toConnect = unconnectedAreas.pop()
-            for area in unconnectedAreas:
-                for x, y in area:
-                    for xi, yi in toConnect:
-                        distance = abs(x-xi) + abs(y-yi)
-                        if distance < bestDistance and (x == xi or y == yi):
-                            bestDistance = distance
-                            c[0] = (x,y)
-                            c[1] = (xi,yi)
+            for x, y in toConnect:
+                column = columns[x]
+                del column[bisect_left(column, y)]
+                row = rows[y]
+                del row[bisect_left(row, x)]
+
+            # Only cells in the same column or row can be joined by a straight corridor
+            # Ties are broken by the order the cells would have been compared in
+            best = None
+            for toConnectIndex, (xi, yi) in enumerate(toConnect):
+                candidates = []
+                column = columns.get(xi)
+                if column:
+                    i = bisect_left(column, yi)
+                    if i < len(column):
+                        candidates.append((xi, column[i]))
+                    if i:
+                        candidates.append((xi, column[i-1]))
+                row = rows.get(yi)
+                if row:
+                    i = bisect_left(row, xi)
+                    if i < len(row):
+                        candidates.append((row[i], yi))
+                    if i:
+                        candidates.append((row[i-1], yi))
+
+                for x, y in candidates:
+                    key = (abs(x-xi) + abs(y-yi), cellOrder[(x, y)], toConnectIndex)
+                    if not best or key < best[0]:
+                        best = (key, (x, y), (xi, yi))
+
+            if not best:
+                self.unjoinedAreas.append(toConnect)
+                continue
+
+            c = [best[1], best[2]]
             c.sort()
             x, y = c[0]
             for x in range(c[0][0]+1, c[1][0]):
@@ -588,6 +774,7 @@ class dungeonGenerator:
                 if self.grid[x][y] == EMPTY:
                     self.grid[x][y] = CORRIDOR_FLOOR
             self.corridors.append((x,y))
+        return self.unjoinedAreas
 
 
 
@@ -1,43 +1,74 @@
 from src.components.item import *
 from src.entity_templates import ENEMY_WEIGHTS, weighted_choice, get_weights_for_level, ITEM_WEIGHTS
+from src.fov import CELL_TRANSPARENT, CELL_WALKABLE, set_map_cells
 from src.map.dungeon_generator import *
+from src.map.indexed_set import IndexedSet
+from src.map.monster_scheduler import MonsterScheduler
+from src.map.overlay_map import OverlayMap
 from src.map.tile import int_to_tile_map, Tiles
+from src.render import RenderOrder
+from src.rng import map_random, seed_level, spawn_random
+from src.timing import NULL_TIMER
 
+# The width and height, in tiles, of the chunks used to find entities within an area
+CHUNK_SIZE = 8
 
-def generate_dungeon(**kwargs):
+
+def remove_small_caves(generator, min_cave_size, timer=NULL_TIMER):
+    # Empties every area smaller than the minimum size, returning the areas that remain
+    with timer.phase('removeSmallCaves'):
+        areas = generator.findUnconnectedAreas()
+
+        remaining_areas = []
+        for area in areas:
+            if len(area) < min_cave_size:
+                for x, y in area:
+                    generator.grid[x][y] = EMPTY
+            else:
+                remaining_areas.append(area)
+
+    return remaining_areas
+
+
+def generate_dungeon(timer=NULL_TIMER, **kwargs):
     width = kwargs.get('width')
     height = kwargs.get('height')
 
     # Dungeon size adjusted by 2 to ensure perimeter walls
-    generator = dungeonGenerator(height - 2, width - 2)
+    generator = dungeonGenerator(height - 2, width - 2, rng=map_random)
 
     caves = kwargs.get('caves')
     if caves:
-        generator.generateCaves(caves)
+        with timer.phase('caves'):
+            generator.generateCaves(caves)
 
         min_cave_size = kwargs.get('min_cave_size')
         if min_cave_size:
-            # Remove small caves
-            unconnected = generator.findUnconnectedAreas()
-            for area in unconnected:
-                if len(area) < min_cave_size:
-                    for x, y in area:
-                        generator.grid[x][y] = EMPTY
+            remove_small_caves(generator, min_cave_size, timer)
 
     # Generate rooms and corridors
-    generator.placeRandomRooms(kwargs.get('min_room_size'), kwargs.get('max_room_size'),
-                               attempts=kwargs.get('max_rooms'))
-    x, y = generator.findEmptySpace(3)
-    while x:
-        generator.generateCorridors('l', x, y)
+    with timer.phase('rooms'):
+        generator.placeRandomRooms(kwargs.get('min_room_size'), kwargs.get('max_room_size'),
+                                   attempts=kwargs.get('max_rooms'))
+    with timer.phase('corridors'):
         x, y = generator.findEmptySpace(3)
+        while x:
+            generator.generateCorridors('l', x, y)
+
+            # Corridors only fill cells, so no space before this one can have become empty
+            x, y = generator.findEmptySpace(3, x, y)
 
     # Join rooms, caves, and corridors
-    generator.connectAllRooms(kwargs.get('extra_door_chance'))
-    unconnected = generator.findUnconnectedAreas()
-    generator.joinUnconnectedAreas(unconnected)
-    generator.pruneDeadends(kwargs.get('prune_deadends'))
-    generator.placeWalls()
+    with timer.phase('connectAllRooms'):
+        generator.connectAllRooms(kwargs.get('extra_door_chance'))
+    with timer.phase('findUnconnectedAreas'):
+        unconnected = generator.findUnconnectedAreas()
+    with timer.phase('joinUnconnectedAreas'):
+        generator.joinUnconnectedAreas(unconnected)
+    with timer.phase('pruneDeadends'):
+        generator.pruneDeadends(kwargs.get('prune_deadends'))
+    with timer.phase('placeWalls'):
+        generator.placeWalls()
 
     # Create a copy of the grid, acting as a buffer for the next step
     grid_copy = [[CAVE_WALL for y in range(height)] for x in range(width)]
@@ -64,7 +95,7 @@ def generate_dungeon(**kwargs):
                     floors.append((x, y))
 
     for i in range(kwargs.get('stairs')):
-        stair_x, stair_y = choice(floors)
+        stair_x, stair_y = map_random.choice(floors)
         floors.remove((stair_x, stair_y))
         grid_copy[stair_x + 1][stair_y + 1] = STAIRS
 
@@ -74,29 +105,31 @@ def generate_dungeon(**kwargs):
     return generator
 
 
-def generate_caves(**kwargs):
+def generate_caves(timer=NULL_TIMER, **kwargs):
     width = kwargs.get('width')
     height = kwargs.get('height')
 
     # Dungeon size adjusted by 2 to ensure perimeter walls
-    generator = dungeonGenerator(height - 2, width - 2)
+    generator = dungeonGenerator(height - 2, width - 2, rng=map_random)
+    unconnected = None
 
     caves = kwargs.get('caves')
     if caves:
-        generator.generateCaves(caves)
+        with timer.phase('caves'):
+            generator.generateCaves(caves)
 
         min_cave_size = kwargs.get('min_cave_size')
         if min_cave_size:
-            # Remove small caves
-            unconnected = generator.findUnconnectedAreas()
-            for area in unconnected:
-                if len(area) < min_cave_size:
-                    for x, y in area:
-                        generator.grid[x][y] = EMPTY
+            # Removing caves leaves the rest as they were, so the caves that remain are the unconnected areas
+            unconnected = remove_small_caves(generator, min_cave_size, timer)
 
-    unconnected = generator.findUnconnectedAreas()
-    generator.joinUnconnectedAreas(unconnected)
-    generator.placeWalls()
+    if unconnected is None:
+        with timer.phase('findUnconnectedAreas'):
+            unconnected = generator.findUnconnectedAreas()
+    with timer.phase('joinUnconnectedAreas'):
+        generator.joinUnconnectedAreas(unconnected)
+    with timer.phase('placeWalls'):
+        generator.placeWalls()
 
     # Create a copy of the grid, acting as a buffer for the next step
     grid_copy = [[CAVE_WALL for y in range(height)] for x in range(width)]
@@ -112,7 +145,7 @@ def generate_caves(**kwargs):
                 floors.append((x, y))
 
     for i in range(kwargs.get('stairs')):
-        stair_x, stair_y = choice(floors)
+        stair_x, stair_y = map_random.choice(floors)
         floors.remove((stair_x, stair_y))
         grid_copy[stair_x + 1][stair_y + 1] = STAIRS
 
@@ -173,17 +206,49 @@ LEVEL_CONFIGURATIONS = {
 
 
 class GameMap:
-    def __init__(self, dungeon_level):
+    def __init__(self, dungeon_level, timer=NULL_TIMER):
         configuration = LEVEL_CONFIGURATIONS.get(dungeon_level)
         self.dungeon_level = dungeon_level
-        self.generator = configuration['generator'](**configuration.get('generator_kwargs'))
+
+        # Generation and spawns draw from streams seeded for this level
+        seed_level(dungeon_level)
+        self.generator = configuration['generator'](timer=timer, **configuration.get('generator_kwargs'))
 
         self.tile_overrides = configuration.get('tile_overrides')
         if not self.tile_overrides:
             self.tile_overrides = {}
 
+        with timer.phase('tiles'):
+            self.initialize_tile_arrays()
+
+            # A persistent FOV map of this level's tiles, updated in place whenever a tile changes
+            self.fov_map = self.generate_fov_map()
+
+            # The same tiles with blocking entities overlaid, used by enemies
+            self.overlay = OverlayMap(self)
+
         self.entities = []
-        self.place_entities(configuration.get('tiles_per_enemy'), configuration.get('tiles_per_item'))
+
+        # Maps each occupied tile to a list of the entities in it
+        self.entity_index = {}
+
+        # Maps each chunk of CHUNK_SIZE by CHUNK_SIZE tiles to a list of the entities in it, kept separately for each
+        # render order so that entities can be drawn in order without sorting them
+        self.chunk_index = {render_order: {} for render_order in RenderOrder}
+
+        # Only entities near the player act on each enemy turn
+        self.scheduler = MonsterScheduler(self)
+
+        # Open tiles (those that can be walked on and have no blocking entities), grouped by tile type
+        # The None key holds every open tile, regardless of type
+        self.open_tiles = {tile_type: IndexedSet() for tile_type in Tiles}
+        self.open_tiles[None] = IndexedSet()
+        with timer.phase('open_tiles'):
+            for x, y in self.get_all_open_tiles(include_entities=False):
+                self.update_open_tile(x, y)
+
+        with timer.phase('entities'):
+            self.place_entities(configuration.get('tiles_per_enemy'), configuration.get('tiles_per_item'))
 
     @property
     def width(self):
@@ -193,9 +258,39 @@ class GameMap:
     def height(self):
         return self.generator.height
 
+    def close(self):
+        # Frees the libtcod maps of this level once it is no longer played, after which they can no longer be used
+        self.overlay.close()
+        libtcod.map_delete(self.fov_map)
+
+    def initialize_tile_arrays(self):
+        # Maps each tile ID to its tile type, with this level's overrides applied
+        self.tile_types = [None] * (max(int_to_tile_map.keys()) + 1)
+        for int_tile, obj_tile in int_to_tile_map.items():
+            self.tile_types[int_tile] = self.tile_overrides.get(int_tile, obj_tile)
+
+        # Translation tables from tile IDs to per-tile properties, used with bytearray.translate
+        self.blocks_table = bytearray(256)
+        self.blocks_sight_table = bytearray(256)
+        self.glyph_table = bytearray(256)
+        self.cell_table = bytearray(256)
+        for int_tile, obj_tile in enumerate(self.tile_types):
+            tile = obj_tile.value
+            self.blocks_table[int_tile] = tile.blocks
+            self.blocks_sight_table[int_tile] = tile.blocks_sight
+            self.glyph_table[int_tile] = ord(tile.character)
+            self.cell_table[int_tile] = (0 if tile.blocks_sight else CELL_TRANSPARENT) | \
+                                        (0 if tile.blocks else CELL_WALKABLE)
+
+        # Tiles are stored row by row (index x + y * width), the same layout libtcod uses for maps and consoles
+        self.tiles = bytearray(self.generator.grid[x][y] for y in range(self.height) for x in range(self.width))
+        self.blocks = self.tiles.translate(self.blocks_table)
+        self.blocks_sight = self.tiles.translate(self.blocks_sight_table)
+        self.glyphs = self.tiles.translate(self.glyph_table)
+
     def initialize_tiles(self):
         # Dungeon size adjusted by 2 to ensure perimeter walls
-        generator = dungeonGenerator(self.height - 2, self.width - 2)
+        generator = dungeonGenerator(self.height - 2, self.width - 2, rng=map_random)
         generator.generateCaves(37, 4)
 
         # Remove small caves
@@ -236,7 +331,7 @@ class GameMap:
                         if generator.grid[nx][ny] == CORRIDOR_FLOOR or generator.grid[nx][ny] == CAVE_FLOOR:
                             grid_copy[nx + 1][ny + 1] = ROOM_FLOOR
 
-        stair_x, stair_y = choice(room_floors)
+        stair_x, stair_y = map_random.choice(room_floors)
         grid_copy[stair_x + 1][stair_y + 1] = STAIRS
 
         generator.grid = grid_copy
@@ -246,114 +341,189 @@ class GameMap:
         level_enemy_weights = get_weights_for_level(ENEMY_WEIGHTS, self.dungeon_level)
         level_item_weights = get_weights_for_level(ITEM_WEIGHTS, self.dungeon_level)
 
-        open_tiles = self.get_all_open_tiles(include_entities=False)
+        open_tiles = IndexedSet(self.get_all_open_tiles(include_entities=False))
 
         # Unoccupied tiles refers to open tiles with no enemies in them
-        unoccupied_tiles = open_tiles.copy()
+        unoccupied_tiles = IndexedSet(open_tiles)
         n_enemies = int(len(open_tiles) / tiles_per_enemy)
         for i in range(n_enemies):
             # The tile in which this entity is placed will no longer be unoccupied
-            tile = choice(unoccupied_tiles)
-            unoccupied_tiles.remove(tile)
+            tile = unoccupied_tiles.pop_choice(spawn_random)
 
             enemy = weighted_choice(level_enemy_weights).value.clone(*tile)
-            self.entities.append(enemy)
+            self.add_entity(enemy)
 
         n_items = int(len(open_tiles) / tiles_per_item)
         for i in range(n_items):
             # The tile in which this item is placed will no longer be open
-            tile = choice(open_tiles)
-            open_tiles.remove(tile)
+            tile = open_tiles.pop_choice(spawn_random)
 
             item = weighted_choice(level_item_weights).value.clone(*tile)
-            self.entities.append(item)
+            self.add_entity(item)
+
+    def add_entity(self, entity):
+        self.entities.append(entity)
+        self.index_entity(entity)
+
+    def remove_entity(self, entity):
+        self.entities.remove(entity)
+        self.unindex_entity(entity)
+        self.scheduler.forget(entity)
+
+    def move_entity(self, entity, x, y):
+        self.unindex_entity(entity)
+        entity.x = x
+        entity.y = y
+        self.index_entity(entity)
+
+    def kill_entity(self, entity, is_player=False):
+        # Killing an entity may change its render order and stop it from blocking its tile, so it is indexed again
+        self.unindex_entity(entity)
+        death_message = entity.kill(is_player)
+        self.index_entity(entity)
+
+        # Dead entities never act again, so the scheduler no longer needs to keep track of them
+        if not is_player:
+            self.scheduler.forget(entity)
+
+        return death_message
+
+    def index_entity(self, entity):
+        tile_entities = self.entity_index.get((entity.x, entity.y))
+        if tile_entities:
+            tile_entities.append(entity)
+        else:
+            self.entity_index[(entity.x, entity.y)] = [entity]
+
+        chunk = (entity.x // CHUNK_SIZE, entity.y // CHUNK_SIZE)
+        chunk_entities = self.chunk_index[entity.render_order].get(chunk)
+        if chunk_entities:
+            chunk_entities.append(entity)
+        else:
+            self.chunk_index[entity.render_order][chunk] = [entity]
+
+        if entity.blocks:
+            self.overlay.mark_dirty(entity.x, entity.y)
+            self.update_open_tile(entity.x, entity.y)
+
+    def unindex_entity(self, entity):
+        tile_entities = self.entity_index[(entity.x, entity.y)]
+        tile_entities.remove(entity)
+        if not tile_entities:
+            del self.entity_index[(entity.x, entity.y)]
+
+        chunk = (entity.x // CHUNK_SIZE, entity.y // CHUNK_SIZE)
+        chunk_entities = self.chunk_index[entity.render_order][chunk]
+        chunk_entities.remove(entity)
+        if not chunk_entities:
+            del self.chunk_index[entity.render_order][chunk]
+
+        if entity.blocks:
+            self.overlay.mark_dirty(entity.x, entity.y)
+            self.update_open_tile(entity.x, entity.y)
+
+    def update_open_tile(self, x, y):
+        tile = (x, y)
+        tile_type = self.get_tile(x, y, value=False)
+
+        if self.is_tile_open(x, y):
+            self.open_tiles[None].add(tile)
+            self.open_tiles[tile_type].add(tile)
+        else:
+            self.open_tiles[None].discard(tile)
+            self.open_tiles[tile_type].discard(tile)
 
     def generate_fov_map(self):
         fov_map = libtcod.map_new(self.width, self.height)
-
-        for x in range(self.width):
-            for y in range(self.height):
-                libtcod.map_set_properties(fov_map, x, y, not self.get_tile(x, y).blocks_sight,
-                                           not self.get_tile(x, y).blocks)
-
-        return fov_map
-
-    def generate_fov_map_with_entities(self, exclude=[]):
-        fov_map = self.generate_fov_map()
-
-        for entity in self.entities:
-            if entity.blocks and entity not in exclude:
-                libtcod.map_set_properties(fov_map, entity.x, entity.y, True, False)
-
+        set_map_cells(fov_map, self.tiles.translate(self.cell_table))
         return fov_map
 
     def contains(self, x, y):
         return 0 <= x < self.width and 0 <= y < self.height
 
     def get_tile(self, x, y, raw=False, value=True):
-        int_tile = self.generator.grid[x][y]
+        int_tile = self.tiles[x + y * self.width]
 
         if raw:
             return int_tile
 
-        obj_tile = self.tile_overrides.get(int_tile)
-        if not obj_tile:
-            obj_tile = int_to_tile_map.get(int_tile)
-
+        obj_tile = self.tile_types[int_tile]
         return obj_tile.value if value else obj_tile
 
-    def is_tile_open(self, x, y, check_entities=True, entity_map=None):
-        if not self.contains(x, y) or self.get_tile(x, y).blocks:
+    def set_tile(self, x, y, int_tile):
+        self.open_tiles[self.get_tile(x, y, value=False)].discard((x, y))
+        self.generator.grid[x][y] = int_tile
+
+        i = x + y * self.width
+        self.tiles[i] = int_tile
+        self.blocks[i] = self.blocks_table[int_tile]
+        self.blocks_sight[i] = self.blocks_sight_table[int_tile]
+        self.glyphs[i] = self.glyph_table[int_tile]
+
+        libtcod.map_set_properties(self.fov_map, x, y, not self.blocks_sight[i], not self.blocks[i])
+        self.overlay.mark_dirty(x, y)
+        self.update_open_tile(x, y)
+
+    def is_tile_open(self, x, y, check_entities=True):
+        if not self.contains(x, y) or self.blocks[x + y * self.width]:
             return False
 
         if not check_entities:
             return True
 
-        blocking_entities = self.get_entities_at_tile(x, y, True, entity_map)
-        return len(blocking_entities) == 0
+        return not self.is_tile_blocked_by_entity(x, y)
+
+    def is_tile_blocked_by_entity(self, x, y):
+        for entity in self.entity_index.get((x, y), ()):
+            if entity.blocks:
+                return True
+        return False
 
-    def get_entities_at_tile(self, x, y, blocking_only=False, entity_map=None):
+    def get_entities_at_tile(self, x, y, blocking_only=False):
         if not (0 <= x < self.width and 0 <= y < self.height):
             return False
 
-        if not entity_map:
-            tile_entities = []
-            for entity in self.entities:
-                if entity.x == x and entity.y == y:
-                    if blocking_only and not entity.blocks:
-                        continue
-                    tile_entities.append(entity)
-            return tile_entities
-        elif blocking_only:
-            tile_entities = []
-            for entity in entity_map[x][y]:
-                if entity.blocks:
-                    tile_entities.append(entity)
-            return tile_entities
+        tile_entities = self.entity_index.get((x, y), ())
+        if blocking_only:
+            return [entity for entity in tile_entities if entity.blocks]
         else:
-            return entity_map[x][y]
+            # A copy is returned, since callers are free to modify the list
+            return list(tile_entities)
 
-    def find_open_tile(self, tile_type=None, include_entities=True, entity_map=None):
-        return choice(self.get_all_open_tiles(tile_type, include_entities, entity_map))
+    def get_entities_in_rect(self, x1, y1, x2, y2, render_order=None):
+        # Returns the entities within the given bounds, inclusive, looking only at the chunks that overlap them
+        # If a render order is given, only entities with that render order are returned
+        render_orders = [render_order] if render_order else RenderOrder
 
-    def get_all_open_tiles(self, tile_type=None, include_entities=True, entity_map=None):
-        if not entity_map:
-            entity_map = self.generate_entity_map()
+        rect_entities = []
+        for render_order in render_orders:
+            chunk_index = self.chunk_index[render_order]
+            for chunk_x in range(x1 // CHUNK_SIZE, x2 // CHUNK_SIZE + 1):
+                for chunk_y in range(y1 // CHUNK_SIZE, y2 // CHUNK_SIZE + 1):
+                    for entity in chunk_index.get((chunk_x, chunk_y), ()):
+                        if x1 <= entity.x <= x2 and y1 <= entity.y <= y2:
+                            rect_entities.append(entity)
+
+        return rect_entities
+
+    def find_open_tile(self, tile_type=None, include_entities=True):
+        if include_entities:
+            return self.open_tiles[tile_type].choice(spawn_random)
+
+        return spawn_random.choice(self.get_all_open_tiles(tile_type, include_entities))
+
+    def get_all_open_tiles(self, tile_type=None, include_entities=True):
+        if include_entities:
+            return list(self.open_tiles[tile_type])
 
         open_tiles = []
+        width = self.width
+        tile_types = self.tile_types
 
-        for x in range(self.generator.width):
-            for y in range(self.generator.height):
-                if self.is_tile_open(x, y, include_entities, entity_map):
-                    if not tile_type or tile_type is self.get_tile(x, y, value=False):
-                        open_tiles.append((x, y))
+        for i, blocks in enumerate(self.blocks):
+            if blocks or (tile_type and tile_type is not tile_types[self.tiles[i]]):
+                continue
 
-        return open_tiles
+            open_tiles.append((i % width, i // width))
 
-    # Returns a 3D list, where the first two dimensions are the same as the game map
-    # The third dimension is a list of the entities in that tile
-    def generate_entity_map(self):
-        entity_map = [[[] for y in range(self.height)] for x in range(self.width)]
-        for entity in self.entities:
-            entity_map[entity.x][entity.y].append(entity)
-        return entity_map
+        return open_tiles
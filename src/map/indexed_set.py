@@ -0,0 +1,47 @@
+import random
+
+
+class IndexedSet:
+    """
+    A set that also keeps its items in a list, so that a random item can be chosen or removed in constant time.
+    Removal swaps the last item into the removed item's place, so the order of items is not preserved.
+    """
+
+    def __init__(self, items=()):
+        self.items = []
+        self.indices = {}
+
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.indices
+
+    def add(self, item):
+        if item not in self.indices:
+            self.indices[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        index = self.indices.pop(item, None)
+        if index is None:
+            return
+
+        last_item = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last_item
+            self.indices[last_item] = index
+
+    def choice(self, rng=random):
+        return rng.choice(self.items)
+
+    def pop_choice(self, rng=random):
+        item = self.choice(rng)
+        self.discard(item)
+        return item
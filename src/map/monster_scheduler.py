@@ -0,0 +1,54 @@
+# How far from the player, in tiles, entities are simulated every turn
+ACTIVE_RADIUS = 20
+
+# The most wandering steps a dormant entity takes to make up for the turns it missed
+MAX_CATCH_UP_TURNS = 10
+
+
+class MonsterScheduler:
+    """
+    Decides which entities act on each enemy turn. Only entities near the player, or still chasing them, are active.
+    The rest stay dormant, and make up for the turns they missed with a few wandering steps once they are woken up, so
+    the cost of a turn depends on the area around the player rather than on the number of entities in the level.
+    """
+
+    def __init__(self, game_map, active_radius=ACTIVE_RADIUS, max_catch_up_turns=MAX_CATCH_UP_TURNS):
+        self.game_map = game_map
+        self.active_radius = active_radius
+        self.max_catch_up_turns = max_catch_up_turns
+
+        self.turn = 0
+        self.last_turns = {}
+        self.active = []
+
+    def get_active_entities(self, x, y):
+        self.turn += 1
+        radius = self.active_radius
+
+        # Entities that are still chasing stay active, no matter how far away they are
+        active = [entity for entity in self.active if entity.ai and entity.ai.remaining_chase_turns > 0]
+        active_set = set(active)
+
+        for entity in self.game_map.get_entities_in_rect(x - radius, y - radius, x + radius, y + radius):
+            if entity.ai and entity not in active_set:
+                active.append(entity)
+                active_set.add(entity)
+
+        for entity in active:
+            # Entities that haven't acted since the level was created count as dormant since then
+            missed_turns = self.turn - self.last_turns.get(entity, 0) - 1
+            if missed_turns > 0:
+                entity.ai.wander(self.game_map, min(missed_turns, self.max_catch_up_turns))
+
+            self.last_turns[entity] = self.turn
+
+        self.active = active
+        return active
+
+    def forget(self, entity):
+        # Called when an entity leaves the level or dies, so that it is neither kept active by a chase it can no longer
+        # take part in nor remembered for the rest of the level. The active list is replaced rather than changed, since
+        # it may be the one the current enemy turn is going through
+        if entity in self.active:
+            self.active = [active_entity for active_entity in self.active if active_entity is not entity]
+        self.last_turns.pop(entity, None)
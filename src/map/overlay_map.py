@@ -0,0 +1,85 @@
+import libtcodpy as libtcod
+from src.fov import compute_fov
+
+
+class OverlayMap:
+    """
+    A libtcod map of a GameMap's tiles with its blocking entities laid over them, used by enemies for pathfinding.
+    Tiles are queued as dirty whenever an entity moves or a tile changes, and only those tiles are rewritten when the
+    map is refreshed, rather than rebuilding the whole map each turn.
+
+    The map also holds a flow field: the walking distance from one tile (usually the player's) to every other tile,
+    shared by all enemies chasing that tile.
+
+    Line of sight is assumed to be symmetric, so a single FOV computed from a tile tells which entities can see it.
+    """
+
+    def __init__(self, game_map):
+        self.game_map = game_map
+        self.fov_map = game_map.generate_fov_map()
+        self.dirty = set()
+
+        # 1.41 approximates sqrt(2), the cost of a diagonal move
+        self.flow_field = libtcod.dijkstra_new(self.fov_map, 1.41)
+
+    def close(self):
+        # Frees the libtcod map and flow field, after which the overlay can no longer be used
+        libtcod.dijkstra_delete(self.flow_field)
+        libtcod.map_delete(self.fov_map)
+
+    def mark_dirty(self, x, y):
+        self.dirty.add((x, y))
+
+    def set_walkable(self, x, y, walkable=True):
+        # Temporarily overrides a tile until it is next refreshed
+        libtcod.map_set_properties(self.fov_map, x, y, not self.game_map.blocks_sight[x + y * self.game_map.width],
+                                   walkable)
+
+    def refresh_tile(self, x, y):
+        i = x + y * self.game_map.width
+        libtcod.map_set_properties(self.fov_map, x, y, not self.game_map.blocks_sight[i],
+                                   not (self.game_map.blocks[i] or self.game_map.is_tile_blocked_by_entity(x, y)))
+
+    def refresh(self):
+        for x, y in self.dirty:
+            self.refresh_tile(x, y)
+        self.dirty.clear()
+
+    def compute_flow_field(self, x, y):
+        self.refresh()
+
+        # The root tile is usually occupied by the player, but must be walkable for the distances to spread from it
+        self.set_walkable(x, y)
+        libtcod.dijkstra_compute(self.flow_field, x, y)
+        self.refresh_tile(x, y)
+
+    def get_flow_step(self, x, y, max_cost=None):
+        # Returns the open neighbor of the given tile closest to the flow field's root, or None if there is none. Only
+        # neighbors whose path cost to the root is below max_cost are considered, where diagonal steps cost 1.41
+        best_step = None
+        best_distance = max_cost
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                step_x = x + dx
+                step_y = y + dy
+                if (dx or dy) and self.game_map.is_tile_open(step_x, step_y):
+                    distance = libtcod.dijkstra_get_distance(self.flow_field, step_x, step_y)
+
+                    # Unreachable tiles have a negative distance
+                    if distance >= 0 and (best_distance is None or distance < best_distance):
+                        best_step = (step_x, step_y)
+                        best_distance = distance
+
+        return best_step
+
+    def get_entities_in_sight(self, x, y, entities):
+        # Returns the set of entities that can see the tile (x, y), with one FOV computation for all of them
+        entities = [entity for entity in entities if entity.sight]
+        if not entities:
+            return set()
+
+        compute_fov(self.fov_map, x, y, max(entity.sight.fov_radius for entity in entities))
+
+        return {entity for entity in entities if libtcod.map_is_in_fov(self.fov_map, entity.x, entity.y) and
+                entity.sight.can_see(x, y)}
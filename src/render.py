@@ -1,7 +1,10 @@
 from enum import Enum, auto
 
-from libtcodpy import Color
-from src.fov import distance
+from functools import lru_cache
+from math import sqrt
+
+from src.color_schemes import FOV_BRIGHTNESS_RANGE
+from src.fov import get_fov_cells
 from src.game_messages import join_list
 from src.game_states import GameStates
 from src.menu import *
@@ -14,6 +17,91 @@ class RenderOrder(Enum):
     CORPSE = auto()
 
 
+# When more than this fraction of the cells change in a frame, the whole console is filled at once instead
+BULK_DRAW_FRACTION = 0.25
+
+
+class RenderCache:
+    """
+    Remembers the character and colors last drawn at each cell of a console, so that only the cells that changed since
+    the previous frame are sent to libtcod. When the camera moves, the console's contents and the cache are shifted
+    together, rather than redrawing every cell. When most of the console changes anyway, such as on the first frame, it
+    is filled with a handful of bulk calls instead.
+    """
+
+    def __init__(self, console):
+        self.console = console
+        self.width = libtcod.console_get_width(console)
+        self.height = libtcod.console_get_height(console)
+        self.cells = [None] * (self.width * self.height)
+        self.top_left = None
+
+        # Used to shift the console's contents, created the first time the camera moves
+        self.scratch_console = None
+
+    def invalidate(self, x=None, y=None):
+        # Forgets a single cell, or every cell if none is given, so that it is redrawn in the next frame
+        if x is None:
+            self.cells = [None] * (self.width * self.height)
+        elif 0 <= x < self.width and 0 <= y < self.height:
+            self.cells[x + y * self.width] = None
+
+    def scroll(self, top_left_x, top_left_y):
+        if self.top_left is None:
+            self.top_left = (top_left_x, top_left_y)
+            return
+
+        dx = top_left_x - self.top_left[0]
+        dy = top_left_y - self.top_left[1]
+        self.top_left = (top_left_x, top_left_y)
+
+        if not dx and not dy:
+            return
+
+        width = self.width
+        height = self.height
+        if abs(dx) >= width or abs(dy) >= height:
+            self.invalidate()
+            return
+
+        # The cell at (x, y) now shows what was drawn at (x + dx, y + dy)
+        if not self.scratch_console:
+            self.scratch_console = libtcod.console_new(width, height)
+
+        kept_width = width - abs(dx)
+        kept_height = height - abs(dy)
+        libtcod.console_blit(self.console, max(0, dx), max(0, dy), kept_width, kept_height, self.scratch_console,
+                             max(0, -dx), max(0, -dy))
+        libtcod.console_blit(self.scratch_console, max(0, -dx), max(0, -dy), kept_width, kept_height, self.console,
+                             max(0, -dx), max(0, -dy))
+
+        # Cells scrolled in from outside the screen are unknown
+        old_cells = self.cells
+        self.cells = [None] * (width * height)
+        for y in range(max(0, -dy), min(height, height - dy)):
+            old_row = (y + dy) * width + max(0, dx)
+            row = y * width + max(0, -dx)
+            self.cells[row:row + kept_width] = old_cells[old_row:old_row + kept_width]
+
+    def draw_cells(self, cells):
+        # cells holds the character, foreground and background of every cell of the console, row by row
+        changed = [i for i, (cell, cached_cell) in enumerate(zip(cells, self.cells)) if cell != cached_cell]
+
+        if len(changed) > len(cells) * BULK_DRAW_FRACTION:
+            characters, foregrounds, backgrounds = zip(*cells)
+            libtcod.console_fill_char(self.console, characters)
+            libtcod.console_fill_foreground(self.console, [color.r for color in foregrounds],
+                                            [color.g for color in foregrounds], [color.b for color in foregrounds])
+            libtcod.console_fill_background(self.console, [color.r for color in backgrounds],
+                                            [color.g for color in backgrounds], [color.b for color in backgrounds])
+        else:
+            width = self.width
+            for i in changed:
+                libtcod.console_put_char_ex(self.console, i % width, i // width, *cells[i])
+
+        self.cells = cells
+
+
 def render_bar(panel, x, y, total_width, name, value, maximum, bar_color, back_color):
     bar_width = int(float(value) / maximum * total_width)
 
@@ -30,7 +118,8 @@ def render_bar(panel, x, y, total_width, name, value, maximum, bar_color, back_c
 
 
 def render_all(console, panel, bar_width, message_log, game_map, player, fov_map, memory, color_scheme,
-               game_state, mouse, menu_selection=0, key_cursor=None, inventory_options=None, viewing_map=False):
+               game_state, mouse, menu_selection=0, key_cursor=None, inventory_options=None, viewing_map=False,
+               render_cache=None):
     # Screen dimensions
     screen_width = libtcod.console_get_width(console)
     screen_height = libtcod.console_get_height(console)
@@ -50,53 +139,96 @@ def render_all(console, panel, bar_width, message_log, game_map, player, fov_map
     top_left_x = camera_x - center_x
     top_left_y = camera_y - center_y
 
+    if not render_cache:
+        # Without a cache from the previous frame, every cell is drawn
+        render_cache = RenderCache(console)
+
     if game_state is GameStates.VICTORY:
         libtcod.console_clear(console)
+        render_cache.invalidate()
         libtcod.console_print_ex(console, center_x, center_y, libtcod.BKGND_DEFAULT, libtcod.CENTER, 'You Win!')
         libtcod.console_blit(console, 0, 0, screen_width, screen_height, 0, 0, 0)
         return
 
-    # Draw all visible and remembered tiles
-    for x in range(screen_width):
-        for y in range(screen_height):
+    # Draw all visible and remembered tiles, reading the map one row at a time
+    map_width = game_map.width
+    map_height = game_map.height
+    tile_types = game_map.tile_types
+
+    # The range of screen columns that fall within the map
+    first_x = max(0, -top_left_x)
+    last_x = min(screen_width, map_width - top_left_x)
+
+    # Only the cells that differ from what is already on the console are drawn
+    render_cache.scroll(top_left_x, top_left_y)
+    unknown_cell = (ord(' '), color_scheme.foreground[None], color_scheme.background[None])
+    cells = []
+
+    in_fov = get_fov_cells(fov_map)
+
+    # Tiles in FOV are shaded by their distance to the player, looked up in a table centered on the player
+    fade = color_scheme.allow_fade and not viewing_map
+    fov_radius = player.sight.fov_radius
+    shade_table = get_shade_table(fov_radius)
+    shade_table_size = 2 * fov_radius + 1
+
+    for y in range(screen_height):
+        tile_y = y + top_left_y
+        if 0 <= tile_y < map_height:
+            row_start = tile_y * map_width + top_left_x
+            row = game_map.tiles[row_start + first_x:row_start + last_x]
+            glyphs = game_map.glyphs[row_start + first_x:row_start + last_x]
+            remembered = memory[row_start + first_x:row_start + last_x]
+            visible = in_fov[row_start + first_x:row_start + last_x]
+        else:
+            row = glyphs = remembered = visible = b''
+
+        shade_y = tile_y - player.y + fov_radius
+        shade_row_start = shade_y * shade_table_size - player.x + fov_radius
+
+        for x in range(screen_width):
             tile_x = x + top_left_x
-            tile_y = y + top_left_y
-            if game_map.contains(tile_x, tile_y) and (viewing_map or memory[tile_x][tile_y]):
-                tile = game_map.get_tile(tile_x, tile_y, value=False)
-                foreground = color_scheme.foreground.get(tile)
-                background = color_scheme.background.get(tile)
-
-                if viewing_map or libtcod.map_is_in_fov(fov_map, tile_x, tile_y):
-                    if color_scheme.allow_fade and not viewing_map:
-                        foreground = apply_fov_gradient(foreground, distance(player.x, player.y, tile_x, tile_y),
-                                                        player.sight.fov_radius)
-                        background = apply_fov_gradient(background, distance(player.x, player.y, tile_x, tile_y),
-                                                        player.sight.fov_radius)
+            if first_x <= x < last_x and row and (viewing_map or remembered[x - first_x]):
+                tile = tile_types[row[x - first_x]]
+
+                if viewing_map or visible[x - first_x]:
+                    if fade:
+                        # Tiles outside of the table are given the darkest shade
+                        if 0 <= shade_y < shade_table_size and 0 <= tile_x - player.x + fov_radius < shade_table_size:
+                            shade = shade_table[shade_row_start + tile_x]
+                        else:
+                            shade = -1
+
+                        foreground = color_scheme.foreground_shades[tile][shade]
+                        background = color_scheme.background_shades[tile][shade]
+                    else:
+                        foreground = color_scheme.foreground[tile]
+                        background = color_scheme.background[tile]
                 else:
-                    foreground = color_scheme.get_memory_color(foreground)
-                    background = color_scheme.get_memory_color(background)
+                    foreground = color_scheme.foreground_memory[tile]
+                    background = color_scheme.background_memory[tile]
 
-                libtcod.console_set_default_foreground(console, foreground)
-                libtcod.console_put_char(console, x, y, tile.value.character)
-                libtcod.console_set_char_background(console, x, y, background, libtcod.BKGND_SET)
+                cells.append((glyphs[x - first_x], foreground, background))
             else:
-                libtcod.console_set_default_foreground(console, color_scheme.foreground[None])
-                libtcod.console_put_char(console, x, y, ' ')
-                libtcod.console_set_char_background(console, x, y, color_scheme.background[None], libtcod.BKGND_SET)
+                cells.append(unknown_cell)
 
-    # Sort entities by their render order
-    ordered_entities = sorted(game_map.entities, key=lambda i: i.render_order.value, reverse=True)
+    render_cache.draw_cells(cells)
 
-    # Draw all visible entities
-    for entity in ordered_entities:
-        if viewing_map or libtcod.map_is_in_fov(fov_map, entity.x, entity.y):
-            libtcod.console_set_default_foreground(console, entity.color)
-            libtcod.console_put_char(console, entity.x - top_left_x, entity.y - top_left_y, entity.char,
-                                     libtcod.BKGND_NONE)
+    # Draw all visible entities on the screen, from the last render order to the first
+    # Entities are drawn over the cached tiles, so their cells must be redrawn in the next frame
+    for render_order in reversed(RenderOrder):
+        for entity in game_map.get_entities_in_rect(top_left_x, top_left_y, top_left_x + screen_width - 1,
+                                                    top_left_y + screen_height - 1, render_order):
+            if viewing_map or in_fov[entity.x + entity.y * map_width]:
+                libtcod.console_set_default_foreground(console, entity.color)
+                libtcod.console_put_char(console, entity.x - top_left_x, entity.y - top_left_y, entity.char,
+                                         libtcod.BKGND_NONE)
+                render_cache.invalidate(entity.x - top_left_x, entity.y - top_left_y)
 
     if key_cursor:
         libtcod.console_set_default_foreground(console, libtcod.white)
         libtcod.console_put_char(console, center_x, center_y, 'X', libtcod.BKGND_NONE)
+        render_cache.invalidate(center_x, center_y)
 
     libtcod.console_blit(console, 0, 0, screen_width, screen_height, 0, 0, 0)
 
@@ -126,10 +258,9 @@ def render_all(console, panel, bar_width, message_log, game_map, player, fov_map
 
     # Print the game messages, one line at a time
     message_y = 1
-    for i in range(max(0, len(message_log.messages) - panel_height + 1), max(0, len(message_log.messages))):
-        message = message_log.messages[i]
-        libtcod.console_set_default_foreground(panel, message.color)
-        libtcod.console_print_ex(panel, message_log.x, message_y, libtcod.BKGND_NONE, libtcod.LEFT, message.text)
+    for line, color in message_log.get_lines(panel_height - 1):
+        libtcod.console_set_default_foreground(panel, color)
+        libtcod.console_print_ex(panel, message_log.x, message_y, libtcod.BKGND_NONE, libtcod.LEFT, line)
         message_y += 1
 
     render_bar(panel, 1, 1, bar_width, 'HP', player.fighter.hp, player.fighter.max_hp,
@@ -152,22 +283,9 @@ def render_all(console, panel, bar_width, message_log, game_map, player, fov_map
                        player, 50, screen_width, screen_height, menu_selection, inventory_options)
 
 
-def clear_all(console, entities, player):
-    screen_width = libtcod.console_get_width(console)
-    screen_height = libtcod.console_get_height(console)
-
-    for entity in entities:
-        libtcod.console_put_char(console, entity.x - player.x + int(screen_width / 2), entity.y - player.y +
-                                 int(screen_height / 2), ' ', libtcod.BKGND_NONE)
-
-
-# Used to brighten tiles near the player and darken ones further away
-def apply_fov_gradient(tile_color, tile_distance, fov_radius, brightness_range=32, max_brightness=16):
-    color_mod = int(brightness_range * (tile_distance / fov_radius)) - max_brightness
-
-    # If the color modifier is above zero, the tile is darkened, otherwise it is lightened
-    if color_mod >= 0:
-        return tile_color.__sub__(Color(color_mod, color_mod, color_mod))
-    else:
-        color_mod = -color_mod
-        return tile_color.__add__(Color(color_mod, color_mod, color_mod))
+# Returns the index of the color scheme's shade for each tile in a square of the given radius, row by row
+@lru_cache(maxsize=None)
+def get_shade_table(fov_radius, brightness_range=FOV_BRIGHTNESS_RANGE):
+    return tuple(int(brightness_range * (sqrt(dx ** 2 + dy ** 2) / fov_radius))
+                 for dy in range(-fov_radius, fov_radius + 1)
+                 for dx in range(-fov_radius, fov_radius + 1))
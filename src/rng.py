@@ -0,0 +1,35 @@
+from random import Random
+
+# Each subsystem draws from its own stream, so that how much randomness one of them uses never changes what another
+# does. With the same seed, every level is generated and populated the same way, and every fight plays out the same
+map_random = Random()
+spawn_random = Random()
+combat_random = Random()
+ai_random = Random()
+
+# The seed of the current game, or None if it is unseeded
+game_seed = None
+
+
+def seed_game(seed=None):
+    # Combat and AI are seeded once for the whole game
+    global game_seed
+    game_seed = seed
+
+    combat_random.seed(stream_seed('combat'))
+    ai_random.seed(stream_seed('ai'))
+
+
+def seed_level(dungeon_level):
+    # Generation and spawns are seeded again for each level, so that a level is the same no matter how the game went
+    # before it
+    map_random.seed(stream_seed('map', dungeon_level))
+    spawn_random.seed(stream_seed('spawn', dungeon_level))
+
+
+def stream_seed(name, dungeon_level=None):
+    # Without a game seed, streams are seeded from the system's randomness
+    if game_seed is None:
+        return None
+
+    return '{0}:{1}:{2}'.format(game_seed, name, dungeon_level)
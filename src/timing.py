@@ -0,0 +1,124 @@
+import json
+from collections import deque
+from math import ceil
+from time import perf_counter
+
+# The number of most recent durations kept for each phase when timing a running game
+TIMING_WINDOW = 1000
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of a sorted, non-empty list
+    return sorted_values[max(0, ceil(fraction * len(sorted_values)) - 1)]
+
+
+class PhaseTimer:
+    """
+    Records how long each named phase of some work takes. A phase is timed with "with timer.phase(name):", and may be
+    timed any number of times. A phase can also be timed for a subject, such as an entity's name, which is recorded as
+    a separate phase named "name:subject".
+
+    With a window, only the most recent durations of each phase are kept, so a long-running game's percentiles follow
+    its recent turns. The count and maximum of each phase always cover every duration.
+    """
+
+    def __init__(self, window=None):
+        self.window = window
+
+        # Maps each phase's name to its durations, in seconds
+        self.durations = {}
+        self.counts = {}
+        self.maximums = {}
+
+    def phase(self, name, subject=None):
+        return TimedPhase(self, name, subject)
+
+    def record(self, name, seconds):
+        phase_durations = self.durations.get(name)
+        if phase_durations is None:
+            self.durations[name] = phase_durations = deque(maxlen=self.window) if self.window else []
+            self.counts[name] = 0
+            self.maximums[name] = seconds
+
+        phase_durations.append(seconds)
+        self.counts[name] += 1
+        if seconds > self.maximums[name]:
+            self.maximums[name] = seconds
+
+    def totals(self):
+        return {name: sum(phase_durations) for name, phase_durations in self.durations.items()}
+
+    def summary(self):
+        # Returns the count, median, 95th percentile and maximum duration of each phase
+        summary = {}
+        for name, phase_durations in self.durations.items():
+            sorted_durations = sorted(phase_durations)
+            summary[name] = {'count': self.counts[name], 'p50': percentile(sorted_durations, 0.5),
+                             'p95': percentile(sorted_durations, 0.95), 'max': self.maximums[name]}
+        return summary
+
+    def dump(self, path):
+        # Appends one JSON record per phase to the file
+        with open(path, 'a') as timing_file:
+            for name, phase_summary in sorted(self.summary().items()):
+                timing_file.write(json.dumps(dict(phase=name, **phase_summary)) + '\n')
+
+    def clear(self):
+        self.durations.clear()
+        self.counts.clear()
+        self.maximums.clear()
+
+
+class TimedPhase:
+    def __init__(self, timer, name, subject=None):
+        self.timer = timer
+        self.name = name
+        self.subject = subject
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = perf_counter() - self.start
+        if self.subject is None:
+            self.timer.record(self.name, seconds)
+        else:
+            self.timer.record('{0}:{1}'.format(self.name, self.subject), seconds)
+
+
+class NullTimer:
+    """
+    A timer that records nothing, used wherever timing is disabled. Its phases are a single shared object that does
+    nothing on entry or exit.
+    """
+
+    def phase(self, name, subject=None):
+        return NULL_PHASE
+
+    def record(self, name, seconds):
+        pass
+
+    def totals(self):
+        return {}
+
+    def summary(self):
+        return {}
+
+    def dump(self, path):
+        pass
+
+    def clear(self):
+        pass
+
+
+class NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_PHASE = NullPhase()
+NULL_TIMER = NullTimer()
@@ -0,0 +1,366 @@
+from enum import Enum, auto
+
+import libtcodpy as libtcod
+from src.components.container import Container
+from src.components.fighter import Fighter
+from src.components.sight import Sight
+from src.components.slots import Slots
+from src.entity import Entity
+from src.game_messages import Message, join_list
+from src.game_states import GameStates
+from src.map.game_map import GameMap, LEVEL_CONFIGURATIONS, STAIRS
+from src.render import RenderOrder
+from src.timing import NULL_TIMER
+
+
+class EventTypes(Enum):
+    """
+    The kinds of events a turn can produce. Each event is a tuple of its type and a value:
+
+    MESSAGE: a Message for the message log
+    DEATH: an entity that died
+    LEVEL_CHANGE: the new GameMap the player is on
+    TURN: the number of turns the player has taken, after they take one
+    GAME_STATE: the state the game was left in, if it is no longer the player's turn
+    """
+    MESSAGE = auto()
+    DEATH = auto()
+    LEVEL_CHANGE = auto()
+    TURN = auto()
+    GAME_STATE = auto()
+
+
+class TurnEngine:
+    """
+    A game in progress: the current level, the player and what they remember of it, and the rules that resolve each
+    turn. It knows nothing of consoles or input, so that the interactive game and headless simulations play by the same
+    rules.
+
+    Actions are given to act() as dicts with a single key, much like the actions produced by input schemes:
+
+    {'move': (dx, dy)}: moves, attacks an entity in the way, or takes the stairs in the way
+    {'pickup': True}: picks up an item on the player's tile
+    {'wait': True}: waits a turn
+    {'drop': item}: drops an item from the player's inventory
+    {'use': item}: uses an item from the player's inventory
+    {'combine': (item, target)}: combines an item with another item in the player's inventory
+    {'throw': (item, (x, y))}: throws an item from the player's inventory at a tile in view
+
+    Each phase of a turn, and of generating each level, is timed by the given timer.
+    """
+
+    def __init__(self, viewing_map=False, timer=NULL_TIMER):
+        self.viewing_map = viewing_map
+        self.timer = timer
+
+        self.game_map = GameMap(1, timer)
+        start_tile = LEVEL_CONFIGURATIONS.get(1).get('start_tile')
+        if viewing_map:
+            player_tile = (int(self.game_map.width / 2), int(self.game_map.height / 2))
+        else:
+            player_tile = self.game_map.find_open_tile(tile_type=start_tile)
+        player_char = '@' if not viewing_map else ' '
+        player_sight = Sight()
+        player_fighter = Fighter(hp=20, defense=1, attack=1, damage=2)
+        player_slots = Slots()
+        player_container = Container(20)
+        self.player = Entity(*player_tile, player_char, libtcod.white, 'player', render_order=RenderOrder.PLAYER,
+                             components={'sight': player_sight, 'fighter': player_fighter, 'slots': player_slots,
+                                         'container': player_container})
+
+        self.game_map.add_entity(self.player)
+
+        self.recompute_fov = True
+        self.fov_map = self.game_map.fov_map
+        self.memory = bytearray(self.game_map.width * self.game_map.height)
+
+        self.game_state = GameStates.PLAYER_TURN
+        self.previous_max_hp = self.player.fighter.max_hp
+
+        # The number of turns the player has taken
+        self.turns = 0
+
+        # The events of the action being resolved
+        self.events = []
+
+        self.actions = {
+            'move': lambda direction: self.move_player(*direction),
+            'pickup': lambda _: self.pickup(),
+            'wait': lambda _: self.wait(),
+            'drop': self.drop,
+            'use': self.use,
+            'combine': lambda items: self.combine(*items),
+            'throw': lambda throw: self.throw(*throw)
+        }
+
+    def act(self, action):
+        # Resolves an action of the player's and, if it took up their turn, the enemies' turn, returning the events
+        self.events = []
+
+        if self.game_state is GameStates.PLAYER_TURN:
+            for name, value in action.items():
+                with self.timer.phase('player'):
+                    player_results, player_acted = self.actions[name](value)
+                self.end_turn(player_results, player_acted)
+
+            if self.game_state is not GameStates.PLAYER_TURN:
+                self.events.append((EventTypes.GAME_STATE, self.game_state))
+
+        return self.events
+
+    def add_message(self, message):
+        self.events.append((EventTypes.MESSAGE, message))
+
+    def kill_entity(self, entity):
+        is_player = entity == self.player
+        self.add_message(self.game_map.kill_entity(entity, is_player=is_player))
+        self.events.append((EventTypes.DEATH, entity))
+
+        if is_player:
+            self.game_state = GameStates.PLAYER_DEAD
+
+    def update_fov(self):
+        if self.recompute_fov:
+            with self.timer.phase('fov'):
+                self.player.sight.get_fov(self.fov_map, self.memory)
+            self.recompute_fov = False
+
+    def close(self):
+        # Frees the current level's libtcod maps once the game is over
+        self.game_map.close()
+
+    def change_level(self, start_tile=None):
+        self.game_map.close()
+        self.game_map = GameMap(self.game_map.dungeon_level + 1, self.timer)
+
+        if self.viewing_map:
+            # When viewing maps, the player stays at the center of each one
+            self.player.x = int(self.game_map.width / 2)
+            self.player.y = int(self.game_map.height / 2)
+        elif start_tile:
+            self.player.x, self.player.y = self.game_map.find_open_tile(tile_type=start_tile)
+        else:
+            self.player.x, self.player.y = self.game_map.find_open_tile()
+        self.game_map.add_entity(self.player)
+
+        self.recompute_fov = True
+        self.fov_map = self.game_map.fov_map
+        self.memory = bytearray(self.game_map.width * self.game_map.height)
+
+        self.events.append((EventTypes.LEVEL_CHANGE, self.game_map))
+
+    # Each of the player's actions returns its results, and whether it used up the player's turn
+
+    def move_player(self, dx, dy):
+        player = self.player
+        game_map = self.game_map
+        player_results = {}
+        player_acted = False
+
+        if player.move(dx, dy, game_map, face=False):
+            player_acted = True
+            self.recompute_fov = True
+
+            entities_at_tile = game_map.get_entities_at_tile(player.x, player.y)
+            entities_at_tile.remove(player)
+            if entities_at_tile:
+                self.add_message(Message('You see {0}.'.format(join_list([
+                    entity.indefinite_name for entity in entities_at_tile])), libtcod.light_gray))
+        else:
+            blocking_entities = game_map.get_entities_at_tile(player.x + dx, player.y + dy, True)
+            if blocking_entities:
+                target = blocking_entities[0]
+                attack_results = player.fighter.attack_entity(target.fighter, is_player=True)
+                player_results.update(attack_results)
+                player_acted = True
+            elif game_map.get_tile(player.x + dx, player.y + dy, raw=True) is STAIRS:
+                configuration = LEVEL_CONFIGURATIONS.get(game_map.dungeon_level + 1)
+                if not configuration:
+                    self.game_state = GameStates.VICTORY
+                else:
+                    # player.fighter.base_max_hp += 10
+                    player.fighter.hp = player.fighter.max_hp
+                    self.change_level(configuration.get('start_tile'))
+
+        return player_results, player_acted
+
+    def pickup(self):
+        player = self.player
+
+        for entity in self.game_map.get_entities_at_tile(player.x, player.y):
+            if entity.item:
+                return player.container.add_item(entity), True
+
+        self.add_message(Message('There is nothing here to pick up.', libtcod.yellow))
+        return {}, False
+
+    def wait(self):
+        if self.viewing_map:
+            # When viewing maps, waiting skips to the next one instead
+            self.change_level()
+            return {}, False
+
+        return {}, True
+
+    def drop(self, item):
+        player = self.player
+
+        player.container.items.remove(item)
+        if player.slots.is_equipped(item):
+            player.slots.toggle_equip(item)
+        item.x = player.x
+        item.y = player.y
+        self.game_map.add_entity(item)
+        self.add_message(Message('You drop {0}.'.format(item.definite_name), libtcod.light_blue))
+
+        return {}, True
+
+    def use(self, item):
+        return item.item.use(self.player, self.game_map), True
+
+    def combine(self, item, target):
+        if item is target:
+            self.add_message(Message('An item cannot be combined with itself.', libtcod.yellow))
+            return {}, False
+
+        if item.item.combine_function:
+            result = item.item.use(self.player, self.game_map, combining=True, combine_target=target)
+            if not result:
+                result = item.item.use(self.player, self.game_map, combining=True, combine_target=item)
+
+            if result:
+                return result, True
+
+        self.add_message(Message('These items cannot be combined.', libtcod.yellow))
+        return {}, False
+
+    def throw(self, item, target_tile):
+        player = self.player
+
+        # Items can only be thrown at open tiles in view
+        if (player.x, player.y) == target_tile or not libtcod.map_is_in_fov(self.fov_map, *target_tile) or \
+                not self.game_map.is_tile_open(*target_tile, check_entities=False):
+            return {}, False
+
+        if player.slots.is_equipped(item):
+            player.slots.toggle_equip(item)
+
+        return item.item.use(player, self.game_map, throwing=True, target_x=target_tile[0],
+                             target_y=target_tile[1]), True
+
+    def end_turn(self, player_results, player_acted):
+        # Applies the results of the player's action, then lets the enemies act if the player's turn was used up
+        player = self.player
+
+        if player_acted:
+            self.turns += 1
+            self.events.append((EventTypes.TURN, self.turns))
+
+            player_results.update(player.update_status_effects())
+            if player.fighter.max_hp < self.previous_max_hp:
+                player.fighter.hp = max(1, player.fighter.hp - (self.previous_max_hp - player.fighter.max_hp))
+            self.previous_max_hp = player.fighter.max_hp
+
+        # Process player turn results
+        attack_message = player_results.get('attack_message')
+        pickup_message = player_results.get('pickup_message')
+        use_message = player_results.get('use_message')
+        effect_message = player_results.get('effect_message')
+        new_messages = [attack_message, pickup_message, use_message, effect_message]
+
+        self.recompute_fov = self.recompute_fov or player_results.get('recompute_fov')
+        dead_entities = player_results.get('dead')
+        next_level = player_results.get('next_level')
+        item_obtained = player_results.get('item_obtained')
+        item_moved = player_results.get('item_moved')
+        item_consumed = player_results.get('item_consumed') or item_moved
+
+        for message in new_messages:
+            if message:
+                self.add_message(message)
+
+        if dead_entities:
+            for dead_entity in dead_entities:
+                self.kill_entity(dead_entity)
+
+        if next_level:
+            self.change_level()
+
+        game_map = self.game_map
+
+        if item_obtained and item_obtained in game_map.entities:
+            game_map.remove_entity(item_obtained)
+
+        if item_consumed or item_moved:
+            if type(item_consumed) is list:
+                for item in item_consumed:
+                    player.container.items.remove(item)
+
+                    if player.slots.is_equipped(item):
+                        player.slots.toggle_equip(item)
+            else:
+                player.container.items.remove(item_consumed)
+
+                if player.slots.is_equipped(item_consumed):
+                    player.slots.toggle_equip(item_consumed)
+
+            if item_moved:
+                item_moved.x = player_results.get('item_x')
+                item_moved.y = player_results.get('item_y')
+
+                if item_moved not in game_map.entities:
+                    game_map.add_entity(item_moved)
+
+        if player_acted:
+            self.game_state = GameStates.ENEMY_TURN
+
+        if self.game_state is GameStates.ENEMY_TURN:
+            self.take_enemy_turn()
+
+    def take_enemy_turn(self):
+        game_map = self.game_map
+        player = self.player
+        timer = self.timer
+
+        # Enemies far from the player stay dormant
+        with timer.phase('scheduler'):
+            enemies = game_map.scheduler.get_active_entities(player.x, player.y)
+
+        # Only the tiles changed since the last enemy turn need to be updated before the flow field is computed
+        with timer.phase('flow_field'):
+            game_map.overlay.compute_flow_field(player.x, player.y)
+
+        # A single FOV from the player finds every enemy that can see them this turn
+        with timer.phase('enemy_sight'):
+            enemies_in_sight = game_map.overlay.get_entities_in_sight(player.x, player.y, enemies)
+
+        with timer.phase('ai'):
+            self.take_enemy_actions(enemies, enemies_in_sight)
+
+    def take_enemy_actions(self, enemies, enemies_in_sight):
+        game_map = self.game_map
+        player = self.player
+        timer = self.timer
+
+        for entity in enemies:
+            if entity.ai:
+                with timer.phase('ai', entity.name):
+                    enemy_results = entity.ai.act(game_map, player, entity in enemies_in_sight)
+
+                # Process enemy turn results
+                attack_message = enemy_results.get('attack_message')
+                dead_entities = enemy_results.get('dead')
+
+                if attack_message:
+                    self.add_message(attack_message)
+
+                if dead_entities:
+                    for dead_entity in dead_entities:
+                        self.kill_entity(dead_entity)
+                        if self.game_state is GameStates.PLAYER_DEAD:
+                            break
+
+            if self.game_state is GameStates.PLAYER_DEAD:
+                break
+        else:
+            self.game_state = GameStates.PLAYER_TURN
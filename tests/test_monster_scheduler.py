@@ -0,0 +1,64 @@
+import unittest
+
+from src.map.monster_scheduler import MonsterScheduler
+
+
+class StubAI:
+    def __init__(self, remaining_chase_turns=0):
+        self.remaining_chase_turns = remaining_chase_turns
+
+    def wander(self, game_map, turns=1):
+        pass
+
+
+class StubEntity:
+    def __init__(self, remaining_chase_turns=0):
+        self.ai = StubAI(remaining_chase_turns)
+
+
+class StubMap:
+    # Only the entities listed in nearby are found around the player
+    def __init__(self):
+        self.nearby = []
+
+    def get_entities_in_rect(self, x1, y1, x2, y2, render_order=None):
+        return list(self.nearby)
+
+
+class MonsterSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.game_map = StubMap()
+        self.scheduler = MonsterScheduler(self.game_map)
+
+    def test_chasing_entity_stays_active_out_of_range(self):
+        entity = StubEntity(remaining_chase_turns=3)
+        self.game_map.nearby = [entity]
+        self.scheduler.get_active_entities(0, 0)
+
+        self.game_map.nearby = []
+        self.assertEqual(self.scheduler.get_active_entities(0, 0), [entity])
+
+    def test_forgotten_chasing_entity_is_not_active(self):
+        # A chasing entity removed from the level, such as by a rune of digging, must not act again
+        entity = StubEntity(remaining_chase_turns=3)
+        self.game_map.nearby = [entity]
+        self.scheduler.get_active_entities(0, 0)
+
+        self.game_map.nearby = []
+        self.scheduler.forget(entity)
+        self.assertEqual(self.scheduler.get_active_entities(0, 0), [])
+        self.assertNotIn(entity, self.scheduler.last_turns)
+
+    def test_forgotten_dead_entity_leaves_no_record(self):
+        entity = StubEntity()
+        self.game_map.nearby = [entity]
+        self.scheduler.get_active_entities(0, 0)
+
+        # Killed entities lose their AI, and are forgotten by the level
+        entity.ai = None
+        self.scheduler.forget(entity)
+        self.assertEqual(self.scheduler.last_turns, {})
+
+
+if __name__ == '__main__':
+    unittest.main()